@@ -0,0 +1,192 @@
+"""Per-user columnar transaction cache for analytics.
+
+Each active user's ledger is held as NumPy columns (dates, cent amounts,
+type flags, category codes), loaded once from both tiers and then patched by
+``ledger.record_transaction_changes`` on every write. Users are evicted
+least-recently-used once the cache exceeds ``Settings.analytics_cache_mb``;
+entries older than ``ANALYTICS_CACHE_TTL_SECONDS`` are reloaded so writes
+made by other workers are picked up.
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from bson import ObjectId
+
+from archive import cold_transactions
+from models import TransactionType
+from schema import TYPE_CODES, owner_filter
+
+
+ANALYTICS_CACHE_TTL_SECONDS = 300
+# Column bytes plus the id list and id -> row dict.
+BYTES_PER_ROW_OVERHEAD = 160
+
+EXPENSE = TYPE_CODES[TransactionType.EXPENSE]
+
+
+def to_datetime64(value: datetime) -> np.datetime64:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, "ms")
+
+
+class UserLedger:
+    """Growable column store with O(1) append, update and swap-remove."""
+
+    def __init__(self, docs: List[dict]):
+        capacity = max(len(docs), 16)
+        self.size = 0
+        self.ids: List[ObjectId] = []
+        self.rows: Dict[ObjectId, int] = {}
+        self.dates = np.empty(capacity, dtype="datetime64[ms]")
+        self.cents = np.empty(capacity, dtype=np.int64)
+        self.types = np.empty(capacity, dtype=np.int8)
+        self.categories = np.empty(capacity, dtype=np.int32)
+        self.loaded_at = time.monotonic()
+        for doc in docs:
+            self.upsert(doc)
+
+    @property
+    def nbytes(self) -> int:
+        columns = self.dates.nbytes + self.cents.nbytes + self.types.nbytes + self.categories.nbytes
+        return columns + self.size * BYTES_PER_ROW_OVERHEAD
+
+    def _grow(self):
+        capacity = len(self.cents) * 2
+        for name in ("dates", "cents", "types", "categories"):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def upsert(self, doc: dict):
+        row = self.rows.get(doc["_id"])
+        if row is None:
+            if self.size == len(self.cents):
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.ids.append(doc["_id"])
+            self.rows[doc["_id"]] = row
+        self.dates[row] = to_datetime64(doc["dt"])
+        self.cents[row] = doc["a"]
+        self.types[row] = doc["t"]
+        self.categories[row] = doc["c"]
+
+    def remove(self, transaction_oid: ObjectId):
+        row = self.rows.pop(transaction_oid, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self.rows[moved] = row
+            for column in (self.dates, self.cents, self.types, self.categories):
+                column[row] = column[last]
+        self.ids.pop()
+        self.size -= 1
+
+    def columns(self):
+        n = self.size
+        return self.dates[:n], self.cents[:n], self.types[:n], self.categories[:n]
+
+
+def summarize(ledger: UserLedger, months: int, rolling_window: int = 3) -> dict:
+    """Vectorised trends, category shares, percentiles and outliers.
+
+    Category values are left as codes; amounts stay in cents.
+    """
+    dates, cents, types, categories = ledger.columns()
+    month_index = dates.astype("datetime64[M]")
+
+    latest = to_datetime64(datetime.now(timezone.utc)).astype("datetime64[M]")
+    window = np.arange(latest - (months - 1), latest + 1)
+    in_window = (month_index >= window[0]) & (month_index <= window[-1])
+
+    positions = (month_index[in_window] - window[0]).astype(np.int64)
+    is_expense = types[in_window] == EXPENSE
+    window_cents = cents[in_window]
+    expense_by_month = np.bincount(positions, weights=np.where(is_expense, window_cents, 0), minlength=months)
+    income_by_month = np.bincount(positions, weights=np.where(is_expense, 0, window_cents), minlength=months)
+
+    running = np.concatenate([[0], np.cumsum(expense_by_month)])
+    rolling = np.full(months, np.nan)
+    if months >= rolling_window:
+        rolling[rolling_window - 1:] = (running[rolling_window:] - running[:-rolling_window]) / rolling_window
+
+    expense_categories = categories[in_window][is_expense]
+    expense_cents = window_cents[is_expense]
+    codes, inverse = np.unique(expense_categories, return_inverse=True)
+    category_totals = np.bincount(inverse, weights=expense_cents) if len(codes) else np.array([])
+    total_expense = category_totals.sum()
+    order = np.argsort(-category_totals)
+
+    percentiles = {}
+    outliers = []
+    if len(expense_cents):
+        p50, p90, p99 = np.percentile(expense_cents, [50, 90, 99])
+        percentiles = {"p50": p50, "p90": p90, "p99": p99}
+        q1, q3 = np.percentile(expense_cents, [25, 75])
+        flagged = np.nonzero(expense_cents > q3 + 1.5 * (q3 - q1))[0]
+        window_rows = np.nonzero(in_window)[0][is_expense]
+        flagged = flagged[np.argsort(-expense_cents[flagged])][:20]
+        outliers = [ledger.ids[row] for row in window_rows[flagged]]
+
+    return {
+        "months": [str(month) for month in window],
+        "income_by_month": income_by_month,
+        "expense_by_month": expense_by_month,
+        "expense_rolling_average": rolling,
+        "category_totals": [(int(codes[i]), category_totals[i]) for i in order],
+        "total_expense": total_expense,
+        "percentiles": percentiles,
+        "outliers": outliers,
+    }
+
+
+class ColumnarCache:
+    def __init__(self):
+        self._ledgers: "OrderedDict[str, UserLedger]" = OrderedDict()
+        self._bytes = 0
+
+    async def get(self, db, user_id: str) -> UserLedger:
+        ledger = self._ledgers.get(user_id)
+        if ledger is None or time.monotonic() - ledger.loaded_at > ANALYTICS_CACHE_TTL_SECONDS:
+            projection = {"dt": 1, "a": 1, "t": 1, "c": 1}
+            docs = await db.transaction_collection.find(owner_filter(user_id), projection).to_list(None)
+            docs += await cold_transactions(db, user_id, projection)
+            self._discard(user_id)
+            ledger = self._ledgers[user_id] = UserLedger(docs)
+            self._bytes += ledger.nbytes
+            self._evict(db.settings.analytics_cache_mb * 1024 * 1024)
+        self._ledgers.move_to_end(user_id)
+        return ledger
+
+    def apply(self, user_id: str, before: Optional[dict], after: Optional[dict]):
+        """Patch a loaded ledger with one write; unloaded users are left alone."""
+        ledger = self._ledgers.get(user_id)
+        if ledger is None:
+            return
+        self._bytes -= ledger.nbytes
+        if after is not None:
+            ledger.upsert(after)
+        elif before is not None:
+            ledger.remove(before["_id"])
+        self._bytes += ledger.nbytes
+
+    def _discard(self, user_id: str):
+        ledger = self._ledgers.pop(user_id, None)
+        if ledger is not None:
+            self._bytes -= ledger.nbytes
+
+    def _evict(self, budget: int):
+        while self._bytes > budget and len(self._ledgers) > 1:
+            _, ledger = self._ledgers.popitem(last=False)
+            self._bytes -= ledger.nbytes
+
+
+columnar_cache = ColumnarCache()
@@ -0,0 +1,202 @@
+"""Cold tier for old transactions.
+
+Transactions older than ``Settings.archive_after_days`` are moved out of the
+hot ``transactions`` collection into one bucket document per user and month:
+
+    {"u": ObjectId, "m": datetime (first of month), "tx": [<stored txn>, ...],
+     "n": int, "ti": int64 income cents, "te": int64 expense cents}
+
+Keeping the per-bucket totals lets the summary read a handful of buckets
+instead of every archived transaction. Usage:
+
+    python archive.py [--older-than-days 365] [--batch-size 500]
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+
+from database import get_database
+from models import TransactionType
+from schema import TYPE_CODES, owner_filter
+
+
+BUCKET_TOTALS = [
+    {
+        "$set": {
+            "n": {"$size": "$tx"},
+            "ti": {"$sum": {"$map": {
+                "input": "$tx",
+                "in": {"$cond": [{"$eq": ["$$this.t", TYPE_CODES[TransactionType.INCOME]]}, "$$this.a", 0]}
+            }}},
+            "te": {"$sum": {"$map": {
+                "input": "$tx",
+                "in": {"$cond": [{"$eq": ["$$this.t", TYPE_CODES[TransactionType.EXPENSE]]}, "$$this.a", 0]}
+            }}},
+        }
+    }
+]
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _unbucket(bucket: dict) -> List[dict]:
+    return [{**doc, "u": bucket["u"]} for doc in bucket.get("tx", [])]
+
+
+def group_by_month(docs: List[dict]) -> Dict[datetime, List[dict]]:
+    """Bucket stored transactions by month, dropping the owner key buckets keep once."""
+    buckets = defaultdict(list)
+    for doc in docs:
+        buckets[month_start(doc["dt"])].append({k: v for k, v in doc.items() if k != "u"})
+    return buckets
+
+
+async def delete_unchanged(collection, docs: List[dict]) -> Set[ObjectId]:
+    """Delete each hot document only if it is unchanged since read; return the ids deleted."""
+    results = await asyncio.gather(*(collection.delete_one(doc) for doc in docs))
+    return {doc["_id"] for doc, result in zip(docs, results) if result.deleted_count}
+
+
+async def archive_user(db, user_oid: ObjectId, cutoff: datetime, batch_size: int) -> int:
+    """Move one user's transactions dated before ``cutoff`` into buckets.
+
+    Every step is idempotent: buckets use ``$addToSet``, and hot documents are
+    only deleted if unchanged since they were read. Anything this run did not
+    delete itself (edited or deleted by the user meanwhile) is pulled back out
+    of the bucket, so the hot tier and the ledger stay authoritative.
+    """
+    archived = 0
+
+    while True:
+        docs = await db.transaction_collection.find(
+            {"u": user_oid, "dt": {"$lt": cutoff}}
+        ).sort("dt", 1).limit(batch_size).to_list(None)
+        if not docs:
+            return archived
+
+        buckets = group_by_month(docs)
+        await db.transaction_archive_collection.bulk_write([
+            UpdateOne({"u": user_oid, "m": month}, {"$addToSet": {"tx": {"$each": txs}}}, upsert=True)
+            for month, txs in buckets.items()
+        ], ordered=False)
+
+        deleted = await delete_unchanged(db.transaction_collection, docs)
+        kept = [doc["_id"] for doc in docs if doc["_id"] not in deleted]
+        if kept:
+            await db.transaction_archive_collection.update_many(
+                {"u": user_oid, "m": {"$in": list(buckets)}},
+                {"$pull": {"tx": {"_id": {"$in": kept}}}}
+            )
+
+        await db.transaction_archive_collection.update_many(
+            {"u": user_oid, "m": {"$in": list(buckets)}}, BUCKET_TOTALS
+        )
+        archived += len(deleted)
+
+        if len(docs) < batch_size or not deleted:
+            return archived
+
+
+async def archive_transactions(db, older_than_days: int, batch_size: int = 500) -> int:
+    cutoff = month_start(datetime.now(timezone.utc) - timedelta(days=older_than_days))
+    archived = 0
+    async for user in db.user_collection.find({}, {"_id": 1}):
+        archived += await archive_user(db, user["_id"], cutoff, batch_size)
+    return archived
+
+
+async def cold_transactions(db, user_id: str, projection: Optional[dict] = None) -> List[dict]:
+    """Every archived transaction of the user, optionally limited to ``projection``'s keys."""
+    if projection is None:
+        bucket_projection = {"tx": 1, "u": 1}
+    else:
+        bucket_projection = {"u": 1, "tx._id": 1, **{f"tx.{key}": 1 for key in projection}}
+
+    docs = []
+    async for bucket in db.transaction_archive_collection.find(
+        owner_filter(user_id), bucket_projection
+    ).sort("m", -1):
+        docs.extend(_unbucket(bucket))
+    return docs
+
+
+async def cold_totals(db, user_id: str) -> dict:
+    results = await db.transaction_archive_collection.aggregate([
+        {"$match": owner_filter(user_id)},
+        {"$group": {"_id": None, "n": {"$sum": "$n"}, "ti": {"$sum": "$ti"}, "te": {"$sum": "$te"}}}
+    ]).to_list(None)
+    if not results:
+        return {"n": 0, "ti": 0, "te": 0}
+    return results[0]
+
+
+async def find_archived(db, user_id: str, transaction_oid: ObjectId) -> Optional[dict]:
+    bucket = await db.transaction_archive_collection.find_one(
+        {**owner_filter(user_id), "tx._id": transaction_oid},
+        {"u": 1, "tx.$": 1}
+    )
+    if bucket is None:
+        return None
+    return _unbucket(bucket)[0]
+
+
+async def restore_transactions(db, user_id: str, tx_filter: dict) -> int:
+    """Move archived transactions matching ``tx_filter`` back to the hot tier.
+
+    ``tx_filter`` uses storage keys (``c``, ``t``, ``dt``, ``_id``...). The hot
+    copies are written first; if the pull then fails, the next archive run
+    folds the duplicates back into their buckets.
+    """
+    owner = owner_filter(user_id)
+    docs = await db.transaction_archive_collection.aggregate([
+        {"$match": {**owner, "tx": {"$elemMatch": tx_filter}}},
+        {"$unwind": "$tx"},
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$tx", owner]}}},
+        {"$match": tx_filter}
+    ]).to_list(None)
+    if not docs:
+        return 0
+
+    ids = [doc["_id"] for doc in docs]
+    await db.transaction_collection.bulk_write(
+        [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False
+    )
+    await db.transaction_archive_collection.update_many(
+        {**owner, "tx._id": {"$in": ids}},
+        [{"$set": {"tx": {"$filter": {
+            "input": "$tx",
+            "cond": {"$not": [{"$in": ["$$this._id", ids]}]}
+        }}}}] + BUCKET_TOTALS
+    )
+    return len(docs)
+
+
+async def restore_transaction(db, user_id: str, transaction_oid: ObjectId) -> bool:
+    """Move one archived transaction back to the hot tier so it can be edited."""
+    return await restore_transactions(db, user_id, {"_id": transaction_oid}) > 0
+
+
+async def main(args):
+    db = get_database()
+    await db.ensure_indexes()
+
+    older_than_days = args.older_than_days or db.settings.archive_after_days
+    for shard in db.shards.values():
+        archived = await archive_transactions(shard, older_than_days, args.batch_size)
+        print(f"{shard.name}: archived {archived} transactions older than {older_than_days} days")
+
+    await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old transactions into monthly archive buckets")
+    parser.add_argument("--older-than-days", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""Opt-in group commit for concurrent inserts.
+
+With ``Settings.write_batching`` enabled, inserts that arrive within
+``write_batch_delay_ms`` of each other, up to ``write_batch_size`` documents,
+are flushed to MongoDB as one unordered ``insert_many``. Every caller still
+awaits its own result: the ``_id`` of its document, or the error that
+document hit. See ``bench_write_batching.py`` for the trade-off between
+throughput and tail latency.
+"""
+import asyncio
+from typing import Dict, List, Set, Tuple
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+
+class InsertBatcher:
+    def __init__(self, collection, max_batch: int, max_delay: float):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer = None
+        self._writes: Set[asyncio.Task] = set()
+
+    async def insert(self, doc: dict) -> ObjectId:
+        loop = asyncio.get_running_loop()
+        doc.setdefault("_id", ObjectId())
+        future = loop.create_future()
+        self._pending.append((doc, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._write(batch))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: List[Tuple[dict, asyncio.Future]]):
+        failures = {}
+        try:
+            await self.collection.insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as exc:
+            for error in exc.details.get("writeErrors", []):
+                error_type = DuplicateKeyError if error.get("code") == 11000 else WriteError
+                failures[error["index"]] = error_type(error.get("errmsg"), error.get("code"), error)
+        except Exception as exc:
+            failures = {index: exc for index in range(len(batch))}
+
+        for index, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failures:
+                future.set_exception(failures[index])
+            else:
+                future.set_result(doc["_id"])
+
+
+class BatcherRegistry:
+    def __init__(self):
+        self._batchers: Dict[Tuple[str, str], InsertBatcher] = {}
+
+    async def insert(self, db, collection, doc: dict) -> ObjectId:
+        """Insert ``doc`` into ``collection``, batched when the settings ask for it."""
+        settings = db.settings
+        if not settings.write_batching:
+            result = await collection.insert_one(doc)
+            return result.inserted_id
+
+        key = (db.name, collection.name)
+        batcher = self._batchers.get(key)
+        if batcher is None:
+            batcher = self._batchers[key] = InsertBatcher(
+                collection, settings.write_batch_size, settings.write_batch_delay_ms / 1000
+            )
+        return await batcher.insert(doc)
+
+
+write_batchers = BatcherRegistry()
@@ -0,0 +1,79 @@
+"""Throughput vs p99 latency of single inserts and batched inserts.
+
+Usage:
+    python bench_write_batching.py [--inserts 5000] [--concurrency 1 8 32 128 512]
+
+Writes to a scratch ``bench_transactions`` collection in a separate
+``<DATABASE_NAME>_bench`` database, which is dropped afterwards.
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.int64 import Int64
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from batching import InsertBatcher
+from database import Settings
+
+
+def sample_document(user_oid: ObjectId) -> dict:
+    return {"u": user_oid, "d": "Coffee", "a": Int64(450), "t": 1, "c": 1, "dt": datetime.now(timezone.utc)}
+
+
+async def run(collection, inserts: int, concurrency: int, batcher=None):
+    user_oid = ObjectId()
+    latencies = []
+    remaining = iter(range(inserts))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            if batcher is None:
+                await collection.insert_one(sample_document(user_oid))
+            else:
+                await batcher.insert(sample_document(user_oid))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    return inserts / elapsed, p99 * 1000
+
+
+async def main(args):
+    settings = Settings()
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    database = client[f"{settings.database_name}_bench"]
+    collection = database.bench_transactions
+
+    modes = [("insert_one", None)] + [
+        (f"batch {size}/{delay}ms", (size, delay))
+        for size in args.batch_sizes for delay in args.delays_ms
+    ]
+
+    print(f"{'mode':<20}{'concurrency':>12}{'inserts/s':>12}{'p99 ms':>10}")
+    for name, config in modes:
+        for concurrency in args.concurrency:
+            batcher = None
+            if config is not None:
+                batcher = InsertBatcher(collection, config[0], config[1] / 1000)
+            throughput, p99 = await run(collection, args.inserts, concurrency, batcher)
+            print(f"{name:<20}{concurrency:>12}{throughput:>12.0f}{p99:>10.2f}")
+
+    await client.drop_database(database.name)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark write batching")
+    parser.add_argument("--inserts", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128, 512])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--delays-ms", type=float, nargs="+", default=[1, 5])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,168 @@
+"""Per-category spending budgets with running counters.
+
+A budget document keeps one spend counter per period it has seen:
+
+    {"user_id": str, "category": str, "category_code": int,
+     "period": "monthly", "limit_amount": float,
+     "spend": {"2024-05": int cents, ...}, "created_at": datetime}
+
+``ledger.record_transaction_changes`` ``$inc``s the counters for every
+expense written, so checking a budget never scans transactions. A counter is
+only incremented once it exists: the first write or read that touches a
+period (the one a budget is created in, or any back-dated one) seeds it from
+the stored transactions, which already include that write.
+"""
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Tuple
+
+from pymongo import ReturnDocument
+
+from models import BudgetPeriod, TransactionType
+from schema import TYPE_CODES, from_cents, owner_filter, to_cents
+
+
+SpendEntry = Tuple[int, datetime, int]
+
+
+def period_key(period: BudgetPeriod, when: datetime) -> str:
+    if period == BudgetPeriod.WEEKLY:
+        year, week, _ = when.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == BudgetPeriod.YEARLY:
+        return f"{when.year}"
+    return f"{when.year}-{when.month:02d}"
+
+
+def period_bounds(period: BudgetPeriod, when: datetime) -> Tuple[datetime, datetime]:
+    day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == BudgetPeriod.WEEKLY:
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    if period == BudgetPeriod.YEARLY:
+        start = day.replace(month=1, day=1)
+        return start, start.replace(year=start.year + 1)
+    start = day.replace(day=1)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+
+async def period_spend(db, user_id: str, category_code: int, start: datetime, end: datetime) -> int:
+    """Expense cents for one category in ``[start, end)`` across both tiers."""
+    match = {
+        "c": category_code,
+        "t": TYPE_CODES[TransactionType.EXPENSE],
+        "dt": {"$gte": start, "$lt": end}
+    }
+    total = 0
+    async for row in db.transaction_collection.aggregate([
+        {"$match": {**owner_filter(user_id), **match}},
+        {"$group": {"_id": None, "total": {"$sum": "$a"}}}
+    ]):
+        total += row["total"]
+    async for row in db.transaction_archive_collection.aggregate([
+        {"$match": {**owner_filter(user_id), "m": {"$lt": end}, "tx": {"$elemMatch": match}}},
+        {"$unwind": "$tx"},
+        {"$replaceRoot": {"newRoot": "$tx"}},
+        {"$match": match},
+        {"$group": {"_id": None, "total": {"$sum": "$a"}}}
+    ]):
+        total += row["total"]
+    return total
+
+
+async def seed_spend(db, budget: dict, key: str, when: datetime) -> bool:
+    """Start the ``key`` counter from the stored transactions.
+
+    Returns ``False`` when another writer started it first.
+    """
+    start, end = period_bounds(budget["period"], when)
+    total = await period_spend(db, budget["user_id"], budget["category_code"], start, end)
+    result = await db.budget_collection.update_one(
+        {"_id": budget["_id"], f"spend.{key}": {"$exists": False}},
+        {"$set": {f"spend.{key}": total}}
+    )
+    return result.modified_count == 1
+
+
+async def with_current_spend(db, budget: dict, now: datetime) -> dict:
+    """Return ``budget`` with a counter for the period containing ``now``."""
+    key = period_key(budget["period"], now)
+    if key in budget.get("spend", {}):
+        return budget
+    await seed_spend(db, budget, key, now)
+    return await db.budget_collection.find_one({"_id": budget["_id"]}) or budget
+
+
+async def _add_spend(db, budget: dict, key: str, delta: int, when: datetime):
+    """``$inc`` the ``key`` counter, seeding it instead if it doesn't exist yet.
+
+    Returns the new total, or ``None`` if the budget is gone.
+    """
+    updated = await db.budget_collection.find_one_and_update(
+        {"_id": budget["_id"], f"spend.{key}": {"$exists": True}},
+        {"$inc": {f"spend.{key}": delta}},
+        projection={f"spend.{key}": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is None:
+        if await seed_spend(db, budget, key, when):
+            # The seed already counts this write.
+            updated = await db.budget_collection.find_one({"_id": budget["_id"]}, {f"spend.{key}": 1})
+        else:
+            updated = await db.budget_collection.find_one_and_update(
+                {"_id": budget["_id"]},
+                {"$inc": {f"spend.{key}": delta}},
+                projection={f"spend.{key}": 1},
+                return_document=ReturnDocument.AFTER
+            )
+    return None if updated is None else updated["spend"][key]
+
+
+async def apply_spend_changes(db, user_id: str, entries: Iterable[SpendEntry]) -> List[dict]:
+    """Adjust budget counters by signed expense cents; return budgets pushed over their limit."""
+    entries = list(entries)
+    if not entries:
+        return []
+
+    budgets = await db.budget_collection.find(
+        {"user_id": user_id, "category_code": {"$in": list({entry[0] for entry in entries})}},
+        {"spend": 0}
+    ).to_list(None)
+
+    alerts = []
+    for budget in budgets:
+        deltas = Counter()
+        dates: Dict[str, datetime] = {}
+        for category_code, when, cents in entries:
+            if category_code == budget["category_code"]:
+                key = period_key(budget["period"], when)
+                deltas[key] += cents
+                dates[key] = when
+
+        for key, delta in deltas.items():
+            if not delta:
+                continue
+            spent = await _add_spend(db, budget, key, delta, dates[key])
+            if spent is None:
+                continue
+
+            limit = to_cents(budget["limit_amount"])
+            if spent - delta <= limit < spent:
+                alerts.append({
+                    "budget_id": str(budget["_id"]),
+                    "category": budget["category"],
+                    "period": budget["period"],
+                    "period_key": key,
+                    "limit_amount": budget["limit_amount"],
+                    "spent_amount": from_cents(spent),
+                })
+
+    if alerts and db.settings.record_budget_events:
+        now = datetime.now(timezone.utc)
+        await db.budget_event_collection.insert_many(
+            [{**alert, "user_id": user_id, "created_at": now} for alert in alerts]
+        )
+
+    return alerts
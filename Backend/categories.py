@@ -0,0 +1,144 @@
+"""Per-user category dictionary with usage counts and a prefix index.
+
+Counts live in the ``user_categories`` collection and are adjusted on every
+transaction and recurring-rule write. Lookups are served from an in-memory
+sorted array per user (searched with ``bisect``), loaded lazily from the
+collection (or rebuilt from the user's transactions the first time) and
+refreshed after ``ttl_seconds`` so other workers' writes show up eventually.
+At most ``max_users`` users are kept, least recently used first out.
+"""
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from schema import category_codes, owner_filter
+
+
+class _UserCategories:
+    def __init__(self, counts: Dict[str, int]):
+        self.counts = counts
+        self.keys: List[Tuple[str, str]] = sorted((name.lower(), name) for name in counts)
+        self.loaded_at = time.monotonic()
+        self.rebuilt = False
+
+    def adjust(self, name: str, delta: int):
+        if name not in self.counts:
+            self.counts[name] = 0
+            insort(self.keys, (name.lower(), name))
+        self.counts[name] += delta
+
+    def search(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        prefix = prefix.lower()
+        matches = []
+        i = bisect_left(self.keys, (prefix,))
+        while i < len(self.keys) and self.keys[i][0].startswith(prefix):
+            name = self.keys[i][1]
+            if self.counts[name] > 0:
+                matches.append((name, self.counts[name]))
+            i += 1
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit]
+
+
+class CategoryIndex:
+    def __init__(self, ttl_seconds: float = 60, max_users: int = 10_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserCategories]" = OrderedDict()
+
+    async def _load(self, db, user_id: str) -> _UserCategories:
+        entry = self._users.get(user_id)
+        if entry is None or time.monotonic() - entry.loaded_at > self.ttl_seconds:
+            counts = {}
+            async for doc in db.user_category_collection.find(owner_filter(user_id)):
+                counts[doc["n"]] = doc["cnt"]
+            rebuilt = not counts
+            if rebuilt:
+                counts = await self._rebuild(db, user_id)
+            entry = self._users[user_id] = _UserCategories(counts)
+            entry.rebuilt = rebuilt
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return entry
+
+    async def _rebuild(self, db, user_id: str) -> Dict[str, int]:
+        """Seed the dictionary from existing transactions and recurring rules."""
+        counts: Dict[str, int] = {}
+
+        by_code = await db.transaction_collection.aggregate([
+            {"$match": owner_filter(user_id)},
+            {"$group": {"_id": "$c", "cnt": {"$sum": 1}}}
+        ]).to_list(None)
+        by_code += await db.transaction_archive_collection.aggregate([
+            {"$match": owner_filter(user_id)},
+            {"$unwind": "$tx"},
+            {"$group": {"_id": "$tx.c", "cnt": {"$sum": 1}}}
+        ]).to_list(None)
+        names = await category_codes.decode_many(db, (row["_id"] for row in by_code))
+        for row in by_code:
+            name = names[row["_id"]]
+            counts[name] = counts.get(name, 0) + row["cnt"]
+
+        async for row in db.recurring_transaction_collection.aggregate([
+            {"$match": {"user_id": user_id}},
+            {"$group": {"_id": "$category", "cnt": {"$sum": 1}}}
+        ]):
+            counts[row["_id"]] = counts.get(row["_id"], 0) + row["cnt"]
+
+        if counts:
+            await db.user_category_collection.bulk_write([
+                UpdateOne(
+                    {**owner_filter(user_id), "n": name},
+                    {"$setOnInsert": {"cnt": cnt}},
+                    upsert=True
+                )
+                for name, cnt in counts.items()
+            ], ordered=False)
+        return counts
+
+    async def search(self, db, user_id: str, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        return (await self._load(db, user_id)).search(prefix, limit)
+
+    async def record_change(
+        self,
+        db,
+        user_id: str,
+        removed: Optional[str] = None,
+        added: Optional[str] = None
+    ):
+        """Move one usage from ``removed`` to ``added``; either may be ``None``."""
+        if removed == added:
+            return
+
+        deltas = {}
+        if removed is not None:
+            deltas[removed] = -1
+        if added is not None:
+            deltas[added] = 1
+        await self.record_counts(db, user_id, deltas)
+
+    async def record_counts(self, db, user_id: str, deltas: Dict[str, int]):
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if not deltas:
+            return
+
+        if user_id not in self._users and (await self._load(db, user_id)).rebuilt:
+            # The rebuild already reflects the write being recorded.
+            return
+
+        await db.user_category_collection.bulk_write([
+            UpdateOne({**owner_filter(user_id), "n": name}, {"$inc": {"cnt": delta}}, upsert=True)
+            for name, delta in deltas.items()
+        ], ordered=False)
+
+        entry = self._users.get(user_id)
+        if entry is not None:
+            for name, delta in deltas.items():
+                entry.adjust(name, delta)
+
+
+category_index = CategoryIndex()
@@ -0,0 +1,25 @@
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from database import Settings
+
+
+def mongo_available() -> bool:
+    try:
+        MongoClient(Settings().mongodb_url, serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "mongo: needs a running MongoDB at MONGODB_URL")
+
+
+def pytest_collection_modifyitems(config, items):
+    marked = [item for item in items if item.get_closest_marker("mongo")]
+    if marked and not mongo_available():
+        skip = pytest.mark.skip(reason="MongoDB is not running")
+        for item in marked:
+            item.add_marker(skip)
@@ -1,31 +1,102 @@
+import hashlib
+import time
+from bisect import bisect
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
 from pydantic_settings import BaseSettings
-from typing import Optional
+
+from schema import legacy_transactions
 
 
 class Settings(BaseSettings):
     mongodb_url: str = "mongodb://localhost:27017"
     database_name: str = "finance_tracker"
+    shard_urls: Dict[str, str] = {}
+    shard_cache_seconds: float = 5
+    archive_after_days: int = 365
+    idempotency_ttl_seconds: int = 24 * 60 * 60
+    record_budget_events: bool = True
+    write_batching: bool = False
+    write_batch_size: int = 100
+    write_batch_delay_ms: float = 2
+    analytics_cache_mb: int = 256
+    report_dir: str = "reports"
+    report_workers: int = 2
+    report_max_active_per_user: int = 2
+    report_ttl_hours: int = 24
+    refresh_token_days: int = 30
 
     class Config:
         env_file = ".env"
 
 
-class DatabaseManager:
-    _instance: Optional['DatabaseManager'] = None
-    _client: Optional[AsyncIOMotorClient] = None
-    _database: Optional[AsyncIOMotorDatabase] = None
+def shard_url_map(settings: Settings) -> Dict[str, str]:
+    """Shard name -> URL.
 
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+    ``mongodb_url`` is always ``shard0``: it is where users registered before
+    sharding live. ``shard_urls`` names the other instances. The directory
+    stores these names, so they must stay attached to the same instance for
+    as long as any user lives there.
+    """
+    shards = {"shard0": settings.mongodb_url}
+    for name, url in settings.shard_urls.items():
+        if name in shards and shards[name] != url:
+            raise ValueError(f"{name} is MONGODB_URL and cannot be remapped in SHARD_URLS")
+        if url in shards.values() and shards.get(name) != url:
+            # Two names for one instance would let a move delete the data it just copied.
+            raise ValueError(f"{url} is listed under more than one shard name")
+        shards[name] = url
+    return shards
 
-    def __init__(self):
-        if self._client is None:
-            self.settings = Settings()
-            self._client = AsyncIOMotorClient(self.settings.mongodb_url)
-            self._database = self._client[self.settings.database_name]
+
+class ShardMoveInProgress(Exception):
+    """Raised while a user's data is being moved between shards."""
+
+
+class HashRing:
+    """Consistent hashing of keys onto named nodes, with virtual replicas."""
+
+    def __init__(self, nodes: List[str], replicas: int = 128):
+        ring = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in nodes for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def node_for(self, key: str) -> str:
+        return self._nodes[bisect(self._hashes, self._hash(key)) % len(self._nodes)]
+
+
+class ShardDatabase:
+    """Collections of one shard.
+
+    User-owned data lives on the user's shard. The category code dictionary
+    and its counter are global, so they always resolve to the directory
+    database.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        database: AsyncIOMotorDatabase,
+        directory: AsyncIOMotorDatabase,
+        settings: Settings
+    ):
+        self.name = name
+        self.url = url
+        self._database = database
+        self._directory = directory
+        self.settings = settings
 
     @property
     def database(self) -> AsyncIOMotorDatabase:
@@ -49,12 +120,174 @@ class DatabaseManager:
     def goal_collection(self):
         return self.database.get_collection("goals")
 
+    @property
+    def category_code_collection(self):
+        return self._directory.get_collection("category_codes")
+
+    @property
+    def counter_collection(self):
+        return self._directory.get_collection("counters")
+
+    @property
+    def user_category_collection(self):
+        return self.database.get_collection("user_categories")
+
+    @property
+    def transaction_archive_collection(self):
+        return self.database.get_collection("transaction_archive")
+
+    @property
+    def idempotency_collection(self):
+        return self.database.get_collection("idempotency_keys")
+
+    @property
+    def budget_collection(self):
+        return self.database.get_collection("budgets")
+
+    @property
+    def budget_event_collection(self):
+        return self.database.get_collection("budget_events")
+
+    @property
+    def report_job_collection(self):
+        return self.database.get_collection("report_jobs")
+
+    async def ensure_indexes(self):
+        await self.transaction_collection.create_index([("u", ASCENDING), ("dt", DESCENDING)])
+        # Only legacy-layout documents carry user_id, so this stays empty once migrated.
+        await self.transaction_collection.create_index(
+            "user_id", partialFilterExpression={"user_id": {"$exists": True}}
+        )
+        await self.user_category_collection.create_index([("u", ASCENDING), ("n", ASCENDING)], unique=True)
+        await self.transaction_archive_collection.create_index([("u", ASCENDING), ("m", DESCENDING)], unique=True)
+        await self.transaction_archive_collection.create_index("tx._id")
+        await self.budget_collection.create_index(
+            [("user_id", ASCENDING), ("category_code", ASCENDING), ("period", ASCENDING)],
+            unique=True
+        )
+        await self.budget_event_collection.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+        await self.idempotency_collection.create_index(
+            "created_at", expireAfterSeconds=self.settings.idempotency_ttl_seconds
+        )
+        await self.report_job_collection.create_index(
+            [("user_id", ASCENDING), ("key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"active": True}
+        )
+        await self.report_job_collection.create_index(
+            [("user_id", ASCENDING), ("slot", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"active": True}
+        )
+        await self.report_job_collection.create_index("expires_at")
+
+
+class DatabaseManager(ShardDatabase):
+    """Process-wide owner of every MongoDB connection pool.
+
+    ``mongodb_url`` hosts the directory (email -> user id -> shard) and the
+    global dictionaries, and doubles as ``shard0``. ``shard_urls`` names the
+    further instances user data is partitioned across. Used directly, the
+    manager behaves as ``shard0``, which is where users registered before
+    sharding live.
+    """
+
+    _instance: Optional['DatabaseManager'] = None
+    _clients: Optional[Dict[str, AsyncIOMotorClient]] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if self._clients is None:
+            settings = Settings()
+            self._clients = {}
+            directory = self._client_for(settings.mongodb_url)[settings.database_name]
+
+            self.shards: Dict[str, ShardDatabase] = {}
+            for name, url in shard_url_map(settings).items():
+                database = self._client_for(url)[settings.database_name]
+                self.shards[name] = ShardDatabase(name, url, database, directory, settings)
+
+            self.default_shard = next(iter(self.shards))
+            self.ring = HashRing(list(self.shards))
+            self._placements: OrderedDict = OrderedDict()
+            default = self.shards[self.default_shard]
+            super().__init__(default.name, default.url, default.database, directory, settings)
+
+    def _client_for(self, url: str) -> AsyncIOMotorClient:
+        if url not in self._clients:
+            self._clients[url] = AsyncIOMotorClient(url)
+        return self._clients[url]
+
+    @property
+    def directory_collection(self):
+        return self._directory.get_collection("user_directory")
+
+    @property
+    def refresh_token_collection(self):
+        return self._directory.get_collection("refresh_tokens")
+
+    async def shard_for(self, user_id: str) -> ShardDatabase:
+        """Route a user to their shard through a short-lived placement cache."""
+        cached = self._placements.get(user_id)
+        if cached is None or time.monotonic() - cached[2] > self.settings.shard_cache_seconds:
+            entry = await self.directory_collection.find_one({"_id": user_id}, {"shard": 1, "moving": 1})
+            # Users registered before sharding have no entry and live on the default shard.
+            shard = entry["shard"] if entry else self.default_shard
+            cached = (shard, bool(entry and entry.get("moving")), time.monotonic())
+            self._placements[user_id] = cached
+            if len(self._placements) > 100_000:
+                self._placements.popitem(last=False)
+        self._placements.move_to_end(user_id)
+
+        if cached[1]:
+            raise ShardMoveInProgress(user_id)
+        if cached[0] not in self.shards:
+            raise RuntimeError(f"user {user_id} is on shard {cached[0]}, which is missing from SHARD_URLS")
+        return self.shards[cached[0]]
+
+    async def find_user_by_email(self, email: str) -> Optional[Tuple[dict, ShardDatabase]]:
+        entry = await self.directory_collection.find_one({"email": email})
+        if entry is not None:
+            shard = await self.shard_for(entry["_id"])
+            user = await shard.user_collection.find_one({"_id": ObjectId(entry["_id"])})
+            return (user, shard) if user else None
+
+        legacy_user = await self.user_collection.find_one({"email": email})
+        if legacy_user is None:
+            return None
+        await self.directory_collection.update_one(
+            {"_id": str(legacy_user["_id"])},
+            {"$setOnInsert": {"email": email, "shard": self.default_shard}},
+            upsert=True
+        )
+        return legacy_user, self
+
+    async def ensure_indexes(self):
+        await self.category_code_collection.create_index("n", unique=True)
+        await self.directory_collection.create_index("email", unique=True, sparse=True)
+        await self.refresh_token_collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.refresh_token_collection.create_index("family")
+        await self.refresh_token_collection.create_index("user_id")
+        for shard in self.shards.values():
+            await shard.ensure_indexes()
+
     async def close(self):
-        if self._client:
-            self._client.close()
-            self._client = None
+        if self._clients:
+            for client in self._clients.values():
+                client.close()
+            self._clients = None
             self._database = None
 
 
 def get_database() -> DatabaseManager:
     return DatabaseManager()
+
+
+async def get_user_database(user_id: str) -> ShardDatabase:
+    shard = await get_database().shard_for(user_id)
+    await legacy_transactions.convert_user(shard, user_id)
+    return shard
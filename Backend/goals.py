@@ -0,0 +1,125 @@
+"""Goal progress derived from transactions tagged with a ``goal_id``.
+
+Each goal keeps ``tagged_cents``, the sum of its tagged transactions, next to
+``current_amount``. Writes to tagged transactions ``$inc`` both fields by the
+same delta, so ``GET /goals`` stays a plain indexed read. Manual
+contributions only touch ``current_amount``.
+
+The reconciliation job recomputes ``tagged_cents`` for every goal from both
+transaction tiers and corrects drift that persists across two passes:
+
+    python goals.py
+"""
+import asyncio
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from bson import ObjectId
+from bson.int64 import Int64
+from pymongo import UpdateOne
+
+from database import get_database
+from schema import from_cents
+
+
+RECONCILE_SETTLE_SECONDS = 5
+
+
+def goal_delta_update(delta_cents: int) -> dict:
+    return {"$inc": {"current_amount": from_cents(delta_cents), "tagged_cents": Int64(delta_cents)}}
+
+
+async def apply_goal_deltas(db, user_id: str, deltas: Dict[ObjectId, int]):
+    operations = [
+        UpdateOne({"_id": goal_oid, "user_id": user_id}, goal_delta_update(delta))
+        for goal_oid, delta in deltas.items() if delta
+    ]
+    if operations:
+        await db.goal_collection.bulk_write(operations, ordered=False)
+
+
+async def untag_goal(db, user_id: str, goal_oid: ObjectId):
+    user_oid = ObjectId(user_id)
+    await db.transaction_collection.update_many(
+        {"u": user_oid, "g": goal_oid}, {"$unset": {"g": ""}}
+    )
+    await db.transaction_archive_collection.update_many(
+        {"u": user_oid, "tx.g": goal_oid},
+        {"$unset": {"tx.$[tagged].g": ""}},
+        array_filters=[{"tagged.g": goal_oid}]
+    )
+
+
+async def tagged_totals(db) -> Counter:
+    totals = Counter()
+    async for row in db.transaction_collection.aggregate([
+        {"$match": {"g": {"$exists": True}}},
+        {"$group": {"_id": "$g", "total": {"$sum": "$a"}}}
+    ]):
+        totals[row["_id"]] += row["total"]
+    async for row in db.transaction_archive_collection.aggregate([
+        {"$match": {"tx.g": {"$exists": True}}},
+        {"$unwind": "$tx"},
+        {"$match": {"tx.g": {"$exists": True}}},
+        {"$group": {"_id": "$tx.g", "total": {"$sum": "$tx.a"}}}
+    ]):
+        totals[row["_id"]] += row["total"]
+    return totals
+
+
+async def goal_drift(db) -> Dict[ObjectId, Tuple[Optional[int], int]]:
+    """``(stored tagged_cents, drift)`` for every goal that disagrees with its transactions.
+
+    Counters are read before the transactions are summed.
+    """
+    counters = {
+        goal["_id"]: goal.get("tagged_cents")
+        async for goal in db.goal_collection.find({}, {"tagged_cents": 1})
+    }
+    totals = await tagged_totals(db)
+    drift = {}
+    for goal_oid, counter in counters.items():
+        delta = totals.get(goal_oid, 0) - (counter or 0)
+        if delta:
+            drift[goal_oid] = (counter, delta)
+    return drift
+
+
+async def reconcile_goal_progress(db, settle_seconds: float = RECONCILE_SETTLE_SECONDS) -> int:
+    """Correct goals whose ``tagged_cents`` disagrees with their transactions.
+
+    A tagged write lands in two steps, the transaction and then the goal's
+    ``$inc``, so a single snapshot can mistake a write in flight for drift.
+    Drift is therefore measured twice, ``settle_seconds`` apart, and only
+    drift that is identical in both passes is corrected. Each correction is
+    applied as a delta, and only if the goal's counter still holds the value
+    read in the second pass, so manual contributions and later writes are
+    preserved.
+    """
+    first = await goal_drift(db)
+    if not first:
+        return 0
+    await asyncio.sleep(settle_seconds)
+    second = await goal_drift(db)
+
+    operations = [
+        UpdateOne({"_id": goal_oid, "tagged_cents": counter}, goal_delta_update(delta))
+        for goal_oid, (counter, delta) in second.items()
+        if goal_oid in first and first[goal_oid][1] == delta
+    ]
+    if not operations:
+        return 0
+    result = await db.goal_collection.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+async def main():
+    db = get_database()
+    for shard in db.shards.values():
+        corrected = await reconcile_goal_progress(shard)
+        print(f"{shard.name}: corrected {corrected} goals")
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+"""``Idempotency-Key`` support for create endpoints.
+
+The first response for a (user, endpoint, key) triple is stored in the
+``idempotency_keys`` collection, which a TTL index expires after
+``Settings.idempotency_ttl_seconds``. Retries replay the stored response
+instead of inserting again. Duplicates that arrive while the first request is
+still running wait for it: on the same worker they share its future, across
+workers they poll the pending record. A pending record is a lease that runs
+out ``PENDING_LEASE_SECONDS`` after its ``created_at``; if the worker holding
+it died mid-request, the next duplicate takes the lease over and runs the
+request itself.
+"""
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Type
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+
+
+PENDING_POLL_SECONDS = 0.05
+# Handlers are a few single-document writes, far shorter than the lease.
+PENDING_LEASE_SECONDS = 10
+PENDING_TIMEOUT_SECONDS = 15
+
+
+def _fingerprint(payload: BaseModel) -> str:
+    # Only fields the client sent: defaults such as ``date=now()`` differ on every retry.
+    body = json.dumps(jsonable_encoder(payload, exclude_unset=True), sort_keys=True)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _mismatch() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Idempotency-Key was already used with a different request body"
+    )
+
+
+class IdempotencyStore:
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def run(
+        self,
+        db,
+        user_id: str,
+        key: Optional[str],
+        scope: str,
+        payload: BaseModel,
+        response_model: Type[BaseModel],
+        status_code: int,
+        handler: Callable[[], Awaitable[dict]]
+    ):
+        if key is None:
+            return await handler()
+
+        record_id = f"{user_id}:{scope}:{key}"
+        fingerprint = _fingerprint(payload)
+
+        in_flight = self._in_flight.get(record_id)
+        if in_flight is not None:
+            stored = await asyncio.shield(in_flight)
+            return self._replay(stored, fingerprint)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[record_id] = future
+        try:
+            stored = await self._execute(
+                db, record_id, fingerprint, response_model, status_code, handler
+            )
+            future.set_result(stored)
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Mark the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[record_id]
+
+        return self._replay(stored, fingerprint)
+
+    async def _execute(self, db, record_id, fingerprint, response_model, status_code, handler) -> dict:
+        try:
+            await db.idempotency_collection.insert_one({
+                "_id": record_id,
+                "fingerprint": fingerprint,
+                "pending": True,
+                "created_at": datetime.now(timezone.utc)
+            })
+        except DuplicateKeyError:
+            record = await self._wait_for(db, record_id, fingerprint)
+            if record is not None:
+                return record
+
+        try:
+            result = await handler()
+        except BaseException:
+            await db.idempotency_collection.delete_one({"_id": record_id})
+            raise
+
+        stored = {
+            "fingerprint": fingerprint,
+            "status_code": status_code,
+            "body": jsonable_encoder(response_model.model_validate(result))
+        }
+        await db.idempotency_collection.update_one(
+            {"_id": record_id},
+            {"$set": {**stored, "pending": False}}
+        )
+        return stored
+
+    async def _wait_for(self, db, record_id: str, fingerprint: str) -> Optional[dict]:
+        """Wait for the pending record to finish; ``None`` if its lease ran out
+        and this request took it over."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + PENDING_TIMEOUT_SECONDS
+
+        while True:
+            record = await db.idempotency_collection.find_one({"_id": record_id})
+            if record is None:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="The original request with this Idempotency-Key failed; retry it"
+                )
+            if not record["pending"]:
+                return record
+            if record["fingerprint"] != fingerprint:
+                raise _mismatch()
+            now = datetime.now(timezone.utc)
+            expired_before = now - timedelta(seconds=PENDING_LEASE_SECONDS)
+            if _as_utc(record["created_at"]) < expired_before:
+                # The worker holding the lease died before storing a response.
+                taken_over = await db.idempotency_collection.find_one_and_update(
+                    {"_id": record_id, "pending": True, "created_at": record["created_at"]},
+                    {"$set": {"created_at": now}}
+                )
+                if taken_over is not None:
+                    return None
+            if loop.time() > deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still in progress"
+                )
+            await asyncio.sleep(PENDING_POLL_SECONDS)
+
+    def _replay(self, stored: dict, fingerprint: str) -> JSONResponse:
+        if stored["fingerprint"] != fingerprint:
+            raise _mismatch()
+        return JSONResponse(status_code=stored["status_code"], content=stored["body"])
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,44 @@
+"""Derived data kept in step with transaction writes.
+
+Every route that creates, updates or deletes transactions reports the stored
+documents before and after the write here, as ``(before, after)`` pairs with
+``None`` for a side that does not exist. Deltas are summed across the whole
+batch so bulk operations touch each derived document once.
+"""
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+from analytics import columnar_cache
+from budgets import apply_spend_changes
+from categories import category_index
+from goals import apply_goal_deltas
+from models import TransactionType
+from schema import TYPE_CODES, category_codes
+
+
+Change = Tuple[Optional[dict], Optional[dict]]
+
+
+async def record_transaction_changes(db, user_id: str, changes: Iterable[Change]) -> List[dict]:
+    """Apply the derived-data deltas and return any budgets the batch pushed over."""
+    category_deltas = Counter()
+    goal_deltas = Counter()
+    spend_entries = []
+
+    for before, after in changes:
+        columnar_cache.apply(user_id, before, after)
+        for doc, sign in ((before, -1), (after, 1)):
+            if doc is None:
+                continue
+            category_deltas[doc["c"]] += sign
+            if doc.get("g") is not None:
+                goal_deltas[doc["g"]] += sign * doc["a"]
+            if doc["t"] == TYPE_CODES[TransactionType.EXPENSE]:
+                spend_entries.append((doc["c"], doc["dt"], sign * doc["a"]))
+
+    names = await category_codes.decode_many(db, category_deltas)
+    await category_index.record_counts(
+        db, user_id, {names[code]: delta for code, delta in category_deltas.items()}
+    )
+    await apply_goal_deltas(db, user_id, goal_deltas)
+    return await apply_spend_changes(db, user_id, spend_entries)
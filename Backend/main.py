@@ -1,27 +1,55 @@
-from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi import FastAPI, HTTPException, Request, status, Depends, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response
+from brotli_asgi import BrotliMiddleware
 from contextlib import asynccontextmanager
+import asyncio
+import math
+import os
 from bson import ObjectId
-from typing import List
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from typing import List, Optional, Tuple
 from datetime import datetime, timedelta, timezone
 
-from database import get_database
+from database import ShardMoveInProgress, get_database, get_user_database
 from models import (
     TransactionCreate,
     TransactionResponse,
     TransactionUpdate,
+    TransactionWriteResponse,
+    TransactionFilter,
+    BulkUpdateRequest,
+    BulkDeleteRequest,
+    BulkOperationResponse,
     SummaryResponse,
+    CategorySuggestion,
+    MonthlyTrend,
+    CategoryShare,
+    AnalyticsResponse,
     TransactionType,
     UserCreate,
     UserLogin,
     UserResponse,
     Token,
+    RefreshRequest,
     RecurringTransactionCreate,
     RecurringTransactionResponse,
     RecurringTransactionUpdate,
     GoalCreate,
     GoalResponse,
-    GoalUpdate
+    GoalUpdate,
+    GoalContributionCreate,
+    GoalContributionResponse,
+    BudgetCreate,
+    BudgetUpdate,
+    BudgetResponse,
+    ReportCreate,
+    ReportFormat,
+    ReportPeriod,
+    ReportResponse,
+    ReportStatus,
+    sparse_transaction_adapter
 )
 from auth import (
     get_password_hash,
@@ -29,11 +57,48 @@ from auth import (
     create_access_token,
     get_current_user_id
 )
+from analytics import columnar_cache, summarize
+from archive import (
+    cold_totals,
+    cold_transactions,
+    find_archived,
+    restore_transaction,
+    restore_transactions
+)
+from batching import write_batchers
+from budgets import period_key, with_current_spend
+from categories import category_index
+from goals import untag_goal
+from idempotency import idempotency_store
+from ledger import record_transaction_changes
+from refresh_tokens import refresh_tokens
+from reports import report_jobs
+from schema import (
+    TRANSACTION_FIELDS,
+    TYPE_NAMES,
+    apply_patch,
+    category_codes,
+    decode_transaction,
+    decode_transactions,
+    encode_transaction,
+    from_cents,
+    owner_filter,
+    to_cents,
+    transaction_projection,
+    update_operations
+)
+
+
+# Responses smaller than this go out uncompressed.
+COMPRESSION_MIN_BYTES = 1024
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await get_database().ensure_indexes()
+    report_jobs.start(get_database())
     yield
+    await report_jobs.stop()
     db_manager = get_database()
     await db_manager.close()
 
@@ -52,6 +117,55 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_BYTES, gzip_fallback=True)
+
+
+BULK_CHUNK_SIZE = 1000
+# Goal documents embed their contribution history; only the history route reads it.
+GOAL_PROJECTION = {"contributions": 0}
+# Only the latest contributions (by date) stay on the goal, bounding its size.
+MAX_GOAL_CONTRIBUTIONS = 1000
+
+FIELDS_QUERY = Query(
+    None,
+    description="Comma-separated transaction fields to return, e.g. description,amount,date"
+)
+
+REPORT_MEDIA_TYPES = {
+    ReportFormat.CSV: "text/csv",
+    ReportFormat.PDF: "application/pdf",
+}
+
+
+@app.exception_handler(ShardMoveInProgress)
+async def shard_move_in_progress_handler(request: Request, exc: ShardMoveInProgress):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Account maintenance in progress, please retry shortly"},
+        headers={"Retry-After": "5"}
+    )
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Validate a ``fields=`` list; ``None`` means the full representation."""
+    if fields is None:
+        return None
+    requested = {name.strip() for name in fields.split(",")} - {"", "id", "_id"}
+    unknown = requested - set(TRANSACTION_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown transaction fields: {', '.join(sorted(unknown))}"
+        )
+    return tuple(sorted(requested))
+
+
+def sparse_response(fields: Tuple[str, ...], content) -> Response:
+    adapter = sparse_transaction_adapter(fields, isinstance(content, list))
+    return Response(
+        adapter.dump_json(adapter.validate_python(content), by_alias=True),
+        media_type="application/json"
+    )
 
 
 def serialize_document(doc: dict) -> dict:
@@ -59,6 +173,28 @@ def serialize_document(doc: dict) -> dict:
     return doc
 
 
+def serialize_goal(doc: dict) -> dict:
+    doc["tagged_amount"] = from_cents(doc.pop("tagged_cents", 0))
+    return serialize_document(doc)
+
+
+async def require_goal(db, user_id: str, goal_id: str):
+    if not ObjectId.is_valid(goal_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid goal ID format"
+        )
+
+    goal = await db.goal_collection.find_one(
+        {"_id": ObjectId(goal_id), "user_id": user_id}, {"_id": 1}
+    )
+    if goal is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Goal not found"
+        )
+
+
 @app.get("/", tags=["Root"])
 async def root():
     return {"message": "BudgetO API with Authentication", "status": "running"}
@@ -73,24 +209,40 @@ async def root():
 async def register(user: UserCreate):
     db = get_database()
 
-    existing_user = await db.user_collection.find_one({"email": user.email})
+    existing_user = await db.find_user_by_email(user.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
 
+    user_oid = ObjectId()
+    shard_name = db.ring.node_for(str(user_oid))
+    try:
+        await db.directory_collection.insert_one(
+            {"_id": str(user_oid), "email": user.email, "shard": shard_name}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+
     user_dict = {
+        "_id": user_oid,
         "email": user.email,
         "password": get_password_hash(user.password),
         "name": user.name,
         "created_at": datetime.now(timezone.utc)
     }
 
-    result = await db.user_collection.insert_one(user_dict)
-    created_user = await db.user_collection.find_one({"_id": result.inserted_id})
+    try:
+        await db.shards[shard_name].user_collection.insert_one(user_dict)
+    except BaseException:
+        await db.directory_collection.delete_one({"_id": str(user_oid)})
+        raise
 
-    return serialize_document(created_user)
+    return serialize_document(user_dict)
 
 
 @app.post(
@@ -101,16 +253,47 @@ async def register(user: UserCreate):
 async def login(credentials: UserLogin):
     db = get_database()
 
-    user = await db.user_collection.find_one({"email": credentials.email})
+    found = await db.find_user_by_email(credentials.email)
+    user = found[0] if found else None
     if not user or not verify_password(credentials.password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
 
-    access_token = create_access_token(data={"sub": str(user["_id"])})
+    user_id = str(user["_id"])
+    access_token = create_access_token(data={"sub": user_id})
 
-    return Token(access_token=access_token, token_type="bearer")
+    return Token(
+        access_token=access_token,
+        token_type="bearer",
+        refresh_token=await refresh_tokens.issue(db, user_id)
+    )
+
+
+@app.post(
+    "/auth/refresh",
+    response_model=Token,
+    tags=["Authentication"]
+)
+async def refresh_access_token(request: RefreshRequest):
+    db = get_database()
+    user_id, refresh_token = await refresh_tokens.rotate(db, request.refresh_token)
+
+    return Token(
+        access_token=create_access_token(data={"sub": user_id}),
+        token_type="bearer",
+        refresh_token=refresh_token
+    )
+
+
+@app.post(
+    "/auth/logout",
+    status_code=status.HTTP_204_NO_CONTENT,
+    tags=["Authentication"]
+)
+async def logout(request: RefreshRequest):
+    await refresh_tokens.revoke(get_database(), request.refresh_token)
 
 
 @app.get(
@@ -119,7 +302,7 @@ async def login(credentials: UserLogin):
     tags=["Authentication"]
 )
 async def get_current_user(user_id: str = Depends(get_current_user_id)):
-    db = get_database()
+    db = await get_user_database(user_id)
 
     user = await db.user_collection.find_one({"_id": ObjectId(user_id)})
     if not user:
@@ -140,7 +323,7 @@ async def update_profile(
     profile_data: dict,
     user_id: str = Depends(get_current_user_id)
 ):
-    db = get_database()
+    db = await get_user_database(user_id)
 
     if "name" not in profile_data:
         raise HTTPException(
@@ -171,7 +354,7 @@ async def change_password(
     password_data: dict,
     user_id: str = Depends(get_current_user_id)
 ):
-    db = get_database()
+    db = await get_user_database(user_id)
 
     if "current_password" not in password_data or "new_password" not in password_data:
         raise HTTPException(
@@ -204,29 +387,47 @@ async def change_password(
         {"$set": {"password": hashed_password}}
     )
 
-    return {"message": "Password changed successfully"}
+    # Sign out every other session; this one continues on a fresh refresh token.
+    directory = get_database()
+    await refresh_tokens.revoke_user(directory, user_id)
+
+    return {
+        "message": "Password changed successfully",
+        "refresh_token": await refresh_tokens.issue(directory, user_id)
+    }
 
 
 @app.post(
     "/transactions",
-    response_model=TransactionResponse,
+    response_model=TransactionWriteResponse,
     status_code=status.HTTP_201_CREATED,
     tags=["Transactions"]
 )
 async def create_transaction(
     transaction: TransactionCreate,
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
 ):
-    db = get_database()
-    transaction_dict = transaction.model_dump()
-    transaction_dict["user_id"] = user_id
+    db = await get_user_database(user_id)
 
-    result = await db.transaction_collection.insert_one(transaction_dict)
-    created_transaction = await db.transaction_collection.find_one(
-        {"_id": result.inserted_id}
-    )
+    async def insert():
+        if transaction.goal_id is not None:
+            await require_goal(db, user_id, transaction.goal_id)
+
+        transaction_dict = transaction.model_dump()
+        transaction_dict["user_id"] = user_id
+        category_code = await category_codes.encode(db, transaction.category)
 
-    return serialize_document(created_transaction)
+        stored = apply_patch({}, encode_transaction(transaction_dict, category_code))
+        stored["_id"] = await write_batchers.insert(db, db.transaction_collection, stored)
+        alerts = await record_transaction_changes(db, user_id, [(None, stored)])
+
+        return {**decode_transaction(stored, transaction.category), "budget_alerts": alerts}
+
+    return await idempotency_store.run(
+        db, user_id, idempotency_key, "transactions", transaction,
+        TransactionWriteResponse, status.HTTP_201_CREATED, insert
+    )
 
 
 @app.get(
@@ -234,16 +435,23 @@ async def create_transaction(
     response_model=List[TransactionResponse],
     tags=["Transactions"]
 )
-async def get_transactions(user_id: str = Depends(get_current_user_id)):
-    db = get_database()
-    transactions = []
+async def get_transactions(
+    fields: Optional[str] = FIELDS_QUERY,
+    user_id: str = Depends(get_current_user_id)
+):
+    db = await get_user_database(user_id)
+    selected = parse_fields(fields)
+    projection = transaction_projection(selected) if selected is not None else None
 
-    async for transaction in db.transaction_collection.find(
-        {"user_id": user_id}
-    ).sort("date", -1):
-        transactions.append(serialize_document(transaction))
+    docs = await db.transaction_collection.find(
+        owner_filter(user_id), projection
+    ).sort("dt", -1).to_list(None)
+    docs += await cold_transactions(db, user_id, projection)
+    docs.sort(key=lambda doc: doc["dt"], reverse=True)
 
-    return transactions
+    if selected is None:
+        return await decode_transactions(db, docs)
+    return sparse_response(selected, await decode_transactions(db, docs, selected))
 
 
 @app.get(
@@ -253,6 +461,7 @@ async def get_transactions(user_id: str = Depends(get_current_user_id)):
 )
 async def get_transaction(
     transaction_id: str,
+    fields: Optional[str] = FIELDS_QUERY,
     user_id: str = Depends(get_current_user_id)
 ):
     if not ObjectId.is_valid(transaction_id):
@@ -261,10 +470,14 @@ async def get_transaction(
             detail="Invalid transaction ID format"
         )
 
-    db = get_database()
+    db = await get_user_database(user_id)
+    selected = parse_fields(fields)
     transaction = await db.transaction_collection.find_one(
-        {"_id": ObjectId(transaction_id), "user_id": user_id}
+        {"_id": ObjectId(transaction_id), **owner_filter(user_id)},
+        transaction_projection(selected) if selected is not None else None
     )
+    if transaction is None:
+        transaction = await find_archived(db, user_id, ObjectId(transaction_id))
 
     if not transaction:
         raise HTTPException(
@@ -272,12 +485,15 @@ async def get_transaction(
             detail="Transaction not found"
         )
 
-    return serialize_document(transaction)
+    if selected is None:
+        return decode_transaction(transaction, await category_codes.decode(db, transaction["c"]))
+    category = await category_codes.decode(db, transaction["c"]) if "category" in selected else None
+    return sparse_response(selected, decode_transaction(transaction, category, selected))
 
 
 @app.put(
     "/transactions/{transaction_id}",
-    response_model=TransactionResponse,
+    response_model=TransactionWriteResponse,
     tags=["Transactions"]
 )
 async def update_transaction(
@@ -291,7 +507,7 @@ async def update_transaction(
             detail="Invalid transaction ID format"
         )
 
-    db = get_database()
+    db = await get_user_database(user_id)
     update_data = transaction.model_dump(exclude_unset=True)
 
     if not update_data:
@@ -300,22 +516,41 @@ async def update_transaction(
             detail="No fields to update"
         )
 
-    result = await db.transaction_collection.update_one(
-        {"_id": ObjectId(transaction_id), "user_id": user_id},
-        {"$set": update_data}
+    if update_data.get("goal_id") is not None:
+        await require_goal(db, user_id, update_data["goal_id"])
+
+    category_code = None
+    if "category" in update_data:
+        category_code = await category_codes.encode(db, update_data["category"])
+
+    query = {"_id": ObjectId(transaction_id), **owner_filter(user_id)}
+    patch = encode_transaction(update_data, category_code)
+    previous_transaction = await db.transaction_collection.find_one_and_update(
+        query, update_operations(patch)
     )
+    if previous_transaction is None and await restore_transaction(db, user_id, query["_id"]):
+        previous_transaction = await db.transaction_collection.find_one_and_update(
+            query, update_operations(patch)
+        )
 
-    if result.matched_count == 0:
+    if previous_transaction is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Transaction not found"
         )
 
-    updated_transaction = await db.transaction_collection.find_one(
-        {"_id": ObjectId(transaction_id)}
+    updated_transaction = apply_patch(previous_transaction, patch)
+    alerts = await record_transaction_changes(
+        db, user_id, [(previous_transaction, updated_transaction)]
     )
 
-    return serialize_document(updated_transaction)
+    return {
+        **decode_transaction(
+            updated_transaction,
+            await category_codes.decode(db, updated_transaction["c"])
+        ),
+        "budget_alerts": alerts
+    }
 
 
 @app.delete(
@@ -333,17 +568,168 @@ async def delete_transaction(
             detail="Invalid transaction ID format"
         )
 
-    db = get_database()
-    result = await db.transaction_collection.delete_one(
-        {"_id": ObjectId(transaction_id), "user_id": user_id}
-    )
+    db = await get_user_database(user_id)
+    query = {"_id": ObjectId(transaction_id), **owner_filter(user_id)}
+    deleted_transaction = await db.transaction_collection.find_one_and_delete(query)
+    if deleted_transaction is None and await restore_transaction(db, user_id, query["_id"]):
+        deleted_transaction = await db.transaction_collection.find_one_and_delete(query)
 
-    if result.deleted_count == 0:
+    if deleted_transaction is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Transaction not found"
         )
 
+    await record_transaction_changes(db, user_id, [(deleted_transaction, None)])
+
+
+async def build_transaction_query(db, criteria: TransactionFilter) -> Optional[dict]:
+    """Translate a bulk filter into a storage query without the owner clause.
+
+    Returns ``None`` when the filter cannot match anything, e.g. an unknown
+    category.
+    """
+    query = {}
+
+    if criteria.ids is not None:
+        if not all(ObjectId.is_valid(transaction_id) for transaction_id in criteria.ids):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid transaction ID format"
+            )
+        query["_id"] = {"$in": [ObjectId(transaction_id) for transaction_id in criteria.ids]}
+
+    if criteria.category is not None:
+        category_code = await category_codes.lookup(db, criteria.category)
+        if category_code is None:
+            return None
+        query["c"] = category_code
+
+    if criteria.type is not None:
+        query.update(encode_transaction({"type": criteria.type}))
+
+    date_range = {}
+    if criteria.start_date is not None:
+        date_range["$gte"] = criteria.start_date
+    if criteria.end_date is not None:
+        date_range["$lte"] = criteria.end_date
+    if date_range:
+        query["dt"] = date_range
+
+    if not query:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Filter must specify at least one criterion"
+        )
+
+    return query
+
+
+async def find_matching_transactions(db, user_id: str, query: dict) -> List[dict]:
+    await restore_transactions(db, user_id, query)
+    return await db.transaction_collection.find(
+        {**query, **owner_filter(user_id)}
+    ).to_list(None)
+
+
+def chunked(items: list, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def write_each(docs: List[dict], write) -> List[dict]:
+    """Run ``write`` per document, a chunk at a time, and return the
+    before-images it reports; documents it no longer matched are dropped.
+
+    Like the single-document routes, each write hands back the document as it
+    was at that moment, so a concurrent ``PUT``/``DELETE`` is never recorded
+    twice or from a stale snapshot.
+    """
+    written = []
+    for chunk in chunked(docs):
+        written += [doc for doc in await asyncio.gather(*map(write, chunk)) if doc is not None]
+    return written
+
+
+@app.post(
+    "/transactions/bulk-update",
+    response_model=BulkOperationResponse,
+    tags=["Transactions"]
+)
+async def bulk_update_transactions(
+    request: BulkUpdateRequest,
+    user_id: str = Depends(get_current_user_id)
+):
+    db = await get_user_database(user_id)
+    update_data = request.update.model_dump(exclude_unset=True)
+
+    if not update_data:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No fields to update"
+        )
+
+    query = await build_transaction_query(db, request.filter)
+    if query is None:
+        return BulkOperationResponse(matched_count=0)
+
+    if update_data.get("goal_id") is not None:
+        await require_goal(db, user_id, update_data["goal_id"])
+
+    category_code = None
+    if "category" in update_data:
+        category_code = await category_codes.encode(db, update_data["category"])
+    patch = encode_transaction(update_data, category_code)
+
+    matched = await find_matching_transactions(db, user_id, query)
+    operations = update_operations(patch)
+
+    async def update(doc: dict) -> Optional[dict]:
+        return await db.transaction_collection.find_one_and_update(
+            {**query, "_id": doc["_id"], **owner_filter(user_id)}, operations
+        )
+
+    changes = []
+    for before in await write_each(matched, update):
+        after = apply_patch(before, patch)
+        if after != before:
+            changes.append((before, after))
+    alerts = await record_transaction_changes(db, user_id, changes)
+
+    return BulkOperationResponse(
+        matched_count=len(matched),
+        modified_count=len(changes),
+        budget_alerts=alerts
+    )
+
+
+@app.post(
+    "/transactions/bulk-delete",
+    response_model=BulkOperationResponse,
+    tags=["Transactions"]
+)
+async def bulk_delete_transactions(
+    request: BulkDeleteRequest,
+    user_id: str = Depends(get_current_user_id)
+):
+    db = await get_user_database(user_id)
+
+    query = await build_transaction_query(db, request.filter)
+    if query is None:
+        return BulkOperationResponse(matched_count=0)
+
+    matched = await find_matching_transactions(db, user_id, query)
+
+    async def delete(doc: dict) -> Optional[dict]:
+        return await db.transaction_collection.find_one_and_delete(
+            {**query, "_id": doc["_id"], **owner_filter(user_id)}
+        )
+
+    deleted = await write_each(matched, delete)
+    await record_transaction_changes(db, user_id, [(doc, None) for doc in deleted])
+
+    return BulkOperationResponse(matched_count=len(matched), deleted_count=len(deleted))
+
 
 @app.get(
     "/summary",
@@ -351,38 +737,92 @@ async def delete_transaction(
     tags=["Summary"]
 )
 async def get_summary(user_id: str = Depends(get_current_user_id)):
-    db = get_database()
+    db = await get_user_database(user_id)
 
     pipeline = [
-        {"$match": {"user_id": user_id}},
+        {"$match": owner_filter(user_id)},
         {
             "$group": {
-                "_id": "$type",
-                "total": {"$sum": "$amount"}
+                "_id": "$t",
+                "total": {"$sum": "$a"},
+                "count": {"$sum": 1}
             }
         }
     ]
 
     results = await db.transaction_collection.aggregate(pipeline).to_list(None)
-    transaction_count = await db.transaction_collection.count_documents({"user_id": user_id})
-
-    total_income = 0.0
-    total_expense = 0.0
+    archived = await cold_totals(db, user_id)
 
-    for result in results:
-        if result["_id"] == TransactionType.INCOME:
-            total_income = result["total"]
-        elif result["_id"] == TransactionType.EXPENSE:
-            total_expense = result["total"]
+    totals = {TYPE_NAMES[result["_id"]]: result["total"] for result in results}
+    total_income = totals.get(TransactionType.INCOME, 0) + archived["ti"]
+    total_expense = totals.get(TransactionType.EXPENSE, 0) + archived["te"]
 
     return SummaryResponse(
-        total_income=total_income,
-        total_expense=total_expense,
-        balance=total_income - total_expense,
-        transaction_count=transaction_count
+        total_income=from_cents(total_income),
+        total_expense=from_cents(total_expense),
+        balance=from_cents(total_income - total_expense),
+        transaction_count=sum(result["count"] for result in results) + archived["n"]
     )
 
 
+@app.get(
+    "/analytics",
+    response_model=AnalyticsResponse,
+    tags=["Summary"]
+)
+async def get_analytics(
+    months: int = Query(12, ge=1, le=120),
+    user_id: str = Depends(get_current_user_id)
+):
+    db = await get_user_database(user_id)
+    ledger = await columnar_cache.get(db, user_id)
+    stats = summarize(ledger, months)
+
+    names = await category_codes.decode_many(db, [code for code, _ in stats["category_totals"]])
+    total_expense = stats["total_expense"]
+    rolling = stats["expense_rolling_average"]
+
+    return AnalyticsResponse(
+        months=[
+            MonthlyTrend(
+                month=month,
+                income=from_cents(float(stats["income_by_month"][i])),
+                expense=from_cents(float(stats["expense_by_month"][i])),
+                expense_rolling_average=None if math.isnan(rolling[i]) else from_cents(float(rolling[i]))
+            )
+            for i, month in enumerate(stats["months"])
+        ],
+        categories=[
+            CategoryShare(
+                category=names[code],
+                amount=from_cents(float(cents)),
+                share=float(cents / total_expense)
+            )
+            for code, cents in stats["category_totals"]
+        ],
+        expense_percentiles={
+            name: from_cents(float(value)) for name, value in stats["percentiles"].items()
+        },
+        outlier_transaction_ids=[str(oid) for oid in stats["outliers"]]
+    )
+
+
+@app.get(
+    "/categories",
+    response_model=List[CategorySuggestion],
+    tags=["Categories"]
+)
+async def get_categories(
+    prefix: str = Query("", max_length=50),
+    limit: int = Query(10, ge=1, le=100),
+    user_id: str = Depends(get_current_user_id)
+):
+    db = await get_user_database(user_id)
+    matches = await category_index.search(db, user_id, prefix, limit)
+
+    return [CategorySuggestion(name=name, count=count) for name, count in matches]
+
+
 # ============================================
 # RECURRING TRANSACTIONS ENDPOINTS
 # ============================================
@@ -395,19 +835,28 @@ async def get_summary(user_id: str = Depends(get_current_user_id)):
 )
 async def create_recurring_transaction(
     recurring_transaction: RecurringTransactionCreate,
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
 ):
-    db = get_database()
-    recurring_dict = recurring_transaction.model_dump()
-    recurring_dict["user_id"] = user_id
-    recurring_dict["created_at"] = datetime.now(timezone.utc)
+    db = await get_user_database(user_id)
 
-    result = await db.recurring_transaction_collection.insert_one(recurring_dict)
-    created_recurring = await db.recurring_transaction_collection.find_one(
-        {"_id": result.inserted_id}
-    )
+    async def insert():
+        recurring_dict = recurring_transaction.model_dump()
+        recurring_dict["user_id"] = user_id
+        recurring_dict["created_at"] = datetime.now(timezone.utc)
+
+        result = await db.recurring_transaction_collection.insert_one(recurring_dict)
+        created_recurring = await db.recurring_transaction_collection.find_one(
+            {"_id": result.inserted_id}
+        )
+        await category_index.record_change(db, user_id, added=recurring_transaction.category)
 
-    return serialize_document(created_recurring)
+        return serialize_document(created_recurring)
+
+    return await idempotency_store.run(
+        db, user_id, idempotency_key, "recurring-transactions", recurring_transaction,
+        RecurringTransactionResponse, status.HTTP_201_CREATED, insert
+    )
 
 
 @app.get(
@@ -416,7 +865,7 @@ async def create_recurring_transaction(
     tags=["Recurring Transactions"]
 )
 async def get_recurring_transactions(user_id: str = Depends(get_current_user_id)):
-    db = get_database()
+    db = await get_user_database(user_id)
     recurring_transactions = []
 
     async for recurring in db.recurring_transaction_collection.find(
@@ -442,7 +891,7 @@ async def get_recurring_transaction(
             detail="Invalid recurring transaction ID format"
         )
 
-    db = get_database()
+    db = await get_user_database(user_id)
     recurring = await db.recurring_transaction_collection.find_one(
         {"_id": ObjectId(recurring_id), "user_id": user_id}
     )
@@ -472,7 +921,7 @@ async def update_recurring_transaction(
             detail="Invalid recurring transaction ID format"
         )
 
-    db = get_database()
+    db = await get_user_database(user_id)
     update_data = recurring_transaction.model_dump(exclude_unset=True)
 
     if not update_data:
@@ -481,19 +930,20 @@ async def update_recurring_transaction(
             detail="No fields to update"
         )
 
-    result = await db.recurring_transaction_collection.update_one(
+    previous_recurring = await db.recurring_transaction_collection.find_one_and_update(
         {"_id": ObjectId(recurring_id), "user_id": user_id},
         {"$set": update_data}
     )
 
-    if result.matched_count == 0:
+    if previous_recurring is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Recurring transaction not found"
         )
 
-    updated_recurring = await db.recurring_transaction_collection.find_one(
-        {"_id": ObjectId(recurring_id)}
+    updated_recurring = {**previous_recurring, **update_data}
+    await category_index.record_change(
+        db, user_id, removed=previous_recurring["category"], added=updated_recurring["category"]
     )
 
     return serialize_document(updated_recurring)
@@ -514,17 +964,19 @@ async def delete_recurring_transaction(
             detail="Invalid recurring transaction ID format"
         )
 
-    db = get_database()
-    result = await db.recurring_transaction_collection.delete_one(
+    db = await get_user_database(user_id)
+    deleted_recurring = await db.recurring_transaction_collection.find_one_and_delete(
         {"_id": ObjectId(recurring_id), "user_id": user_id}
     )
 
-    if result.deleted_count == 0:
+    if deleted_recurring is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Recurring transaction not found"
         )
 
+    await category_index.record_change(db, user_id, removed=deleted_recurring["category"])
+
 
 # ============================================
 # GOALS ENDPOINTS
@@ -538,19 +990,27 @@ async def delete_recurring_transaction(
 )
 async def create_goal(
     goal: GoalCreate,
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    idempotency_key: Optional[str] = Header(None, max_length=255)
 ):
-    db = get_database()
-    goal_dict = goal.model_dump()
-    goal_dict["user_id"] = user_id
-    goal_dict["created_at"] = datetime.now(timezone.utc)
+    db = await get_user_database(user_id)
 
-    result = await db.goal_collection.insert_one(goal_dict)
-    created_goal = await db.goal_collection.find_one(
-        {"_id": result.inserted_id}
-    )
+    async def insert():
+        goal_dict = goal.model_dump()
+        goal_dict["user_id"] = user_id
+        goal_dict["created_at"] = datetime.now(timezone.utc)
 
-    return serialize_document(created_goal)
+        result = await db.goal_collection.insert_one(goal_dict)
+        created_goal = await db.goal_collection.find_one(
+            {"_id": result.inserted_id}
+        )
+
+        return serialize_goal(created_goal)
+
+    return await idempotency_store.run(
+        db, user_id, idempotency_key, "goals", goal,
+        GoalResponse, status.HTTP_201_CREATED, insert
+    )
 
 
 @app.get(
@@ -559,13 +1019,13 @@ async def create_goal(
     tags=["Goals"]
 )
 async def get_goals(user_id: str = Depends(get_current_user_id)):
-    db = get_database()
+    db = await get_user_database(user_id)
     goals = []
 
     async for goal in db.goal_collection.find(
-        {"user_id": user_id}
+        {"user_id": user_id}, GOAL_PROJECTION
     ).sort("created_at", -1):
-        goals.append(serialize_document(goal))
+        goals.append(serialize_goal(goal))
 
     return goals
 
@@ -585,9 +1045,9 @@ async def get_goal(
             detail="Invalid goal ID format"
         )
 
-    db = get_database()
+    db = await get_user_database(user_id)
     goal = await db.goal_collection.find_one(
-        {"_id": ObjectId(goal_id), "user_id": user_id}
+        {"_id": ObjectId(goal_id), "user_id": user_id}, GOAL_PROJECTION
     )
 
     if not goal:
@@ -596,7 +1056,7 @@ async def get_goal(
             detail="Goal not found"
         )
 
-    return serialize_document(goal)
+    return serialize_goal(goal)
 
 
 @app.put(
@@ -615,7 +1075,7 @@ async def update_goal(
             detail="Invalid goal ID format"
         )
 
-    db = get_database()
+    db = await get_user_database(user_id)
     update_data = goal.model_dump(exclude_unset=True)
 
     if not update_data:
@@ -636,10 +1096,10 @@ async def update_goal(
         )
 
     updated_goal = await db.goal_collection.find_one(
-        {"_id": ObjectId(goal_id)}
+        {"_id": ObjectId(goal_id)}, GOAL_PROJECTION
     )
 
-    return serialize_document(updated_goal)
+    return serialize_goal(updated_goal)
 
 
 @app.delete(
@@ -657,7 +1117,7 @@ async def delete_goal(
             detail="Invalid goal ID format"
         )
 
-    db = get_database()
+    db = await get_user_database(user_id)
     result = await db.goal_collection.delete_one(
         {"_id": ObjectId(goal_id), "user_id": user_id}
     )
@@ -667,3 +1127,307 @@ async def delete_goal(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Goal not found"
         )
+
+    await untag_goal(db, user_id, ObjectId(goal_id))
+
+
+@app.post(
+    "/goals/{goal_id}/contributions",
+    response_model=GoalResponse,
+    status_code=status.HTTP_201_CREATED,
+    tags=["Goals"]
+)
+async def add_goal_contribution(
+    goal_id: str,
+    contribution: GoalContributionCreate,
+    user_id: str = Depends(get_current_user_id)
+):
+    if not ObjectId.is_valid(goal_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid goal ID format"
+        )
+
+    db = await get_user_database(user_id)
+    contribution_dict = contribution.model_dump()
+    contribution_dict["_id"] = ObjectId()
+
+    # The balance and its history change in one single-document write.
+    updated_goal = await db.goal_collection.find_one_and_update(
+        {"_id": ObjectId(goal_id), "user_id": user_id},
+        {
+            "$inc": {"current_amount": contribution.amount},
+            "$push": {"contributions": {
+                "$each": [contribution_dict],
+                "$sort": {"date": 1},
+                "$slice": -MAX_GOAL_CONTRIBUTIONS
+            }}
+        },
+        projection=GOAL_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+
+    if updated_goal is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Goal not found"
+        )
+
+    return serialize_goal(updated_goal)
+
+
+@app.get(
+    "/goals/{goal_id}/contributions",
+    response_model=List[GoalContributionResponse],
+    tags=["Goals"]
+)
+async def get_goal_contributions(
+    goal_id: str,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    user_id: str = Depends(get_current_user_id)
+):
+    if not ObjectId.is_valid(goal_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid goal ID format"
+        )
+
+    db = await get_user_database(user_id)
+    in_range = []
+    if start_date is not None:
+        in_range.append({"$gte": ["$$this.date", start_date]})
+    if end_date is not None:
+        in_range.append({"$lte": ["$$this.date", end_date]})
+
+    goals = await db.goal_collection.aggregate([
+        {"$match": {"_id": ObjectId(goal_id), "user_id": user_id}},
+        {"$project": {"contributions": {"$filter": {
+            "input": {"$ifNull": ["$contributions", []]},
+            "cond": {"$and": in_range}
+        }}}}
+    ]).to_list(None)
+    if not goals:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Goal not found"
+        )
+
+    # Stored oldest first by the capped $push.
+    return [
+        serialize_document({**contribution, "goal_id": goal_id, "user_id": user_id})
+        for contribution in reversed(goals[0]["contributions"])
+    ]
+
+
+# ============================================
+# BUDGETS ENDPOINTS
+# ============================================
+
+def serialize_budget(doc: dict, now: datetime) -> dict:
+    key = period_key(doc["period"], now)
+    spent = doc.pop("spend", {}).get(key, 0)
+    limit = to_cents(doc["limit_amount"])
+    doc.pop("category_code", None)
+    doc["period_key"] = key
+    doc["spent_amount"] = from_cents(spent)
+    doc["remaining_amount"] = from_cents(max(limit - spent, 0))
+    doc["is_over_budget"] = spent > limit
+    return serialize_document(doc)
+
+
+@app.post(
+    "/budgets",
+    response_model=BudgetResponse,
+    status_code=status.HTTP_201_CREATED,
+    tags=["Budgets"]
+)
+async def create_budget(
+    budget: BudgetCreate,
+    user_id: str = Depends(get_current_user_id)
+):
+    db = await get_user_database(user_id)
+    now = datetime.now(timezone.utc)
+    category_code = await category_codes.encode(db, budget.category)
+
+    budget_dict = budget.model_dump()
+    budget_dict["user_id"] = user_id
+    budget_dict["category_code"] = category_code
+    budget_dict["created_at"] = now
+    # Counters are seeded after the insert, so expenses written meanwhile
+    # either seed the counter themselves or are included in the seed.
+    budget_dict["spend"] = {}
+
+    try:
+        result = await db.budget_collection.insert_one(budget_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="A budget for this category and period already exists"
+        )
+
+    budget_dict["_id"] = result.inserted_id
+    return serialize_budget(await with_current_spend(db, budget_dict, now), now)
+
+
+@app.get(
+    "/budgets",
+    response_model=List[BudgetResponse],
+    tags=["Budgets"]
+)
+async def get_budgets(user_id: str = Depends(get_current_user_id)):
+    db = await get_user_database(user_id)
+    now = datetime.now(timezone.utc)
+    budgets = []
+
+    async for budget in db.budget_collection.find({"user_id": user_id}).sort("created_at", -1):
+        budgets.append(serialize_budget(await with_current_spend(db, budget, now), now))
+
+    return budgets
+
+
+@app.put(
+    "/budgets/{budget_id}",
+    response_model=BudgetResponse,
+    tags=["Budgets"]
+)
+async def update_budget(
+    budget_id: str,
+    budget: BudgetUpdate,
+    user_id: str = Depends(get_current_user_id)
+):
+    if not ObjectId.is_valid(budget_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid budget ID format"
+        )
+
+    db = await get_user_database(user_id)
+    updated_budget = await db.budget_collection.find_one_and_update(
+        {"_id": ObjectId(budget_id), "user_id": user_id},
+        {"$set": budget.model_dump()},
+        return_document=ReturnDocument.AFTER
+    )
+
+    if updated_budget is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Budget not found"
+        )
+
+    now = datetime.now(timezone.utc)
+    return serialize_budget(await with_current_spend(db, updated_budget, now), now)
+
+
+@app.delete(
+    "/budgets/{budget_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    tags=["Budgets"]
+)
+async def delete_budget(
+    budget_id: str,
+    user_id: str = Depends(get_current_user_id)
+):
+    if not ObjectId.is_valid(budget_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid budget ID format"
+        )
+
+    db = await get_user_database(user_id)
+    result = await db.budget_collection.delete_one(
+        {"_id": ObjectId(budget_id), "user_id": user_id}
+    )
+
+    if result.deleted_count == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Budget not found"
+        )
+
+
+# ============================================
+# REPORTS ENDPOINTS
+# ============================================
+
+async def require_report(db, user_id: str, report_id: str) -> dict:
+    if not ObjectId.is_valid(report_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid report ID format"
+        )
+
+    report = await db.report_job_collection.find_one(
+        {"_id": ObjectId(report_id), "user_id": user_id}
+    )
+    if report is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report not found"
+        )
+    return report
+
+
+@app.post(
+    "/reports",
+    response_model=ReportResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Reports"]
+)
+async def create_report(
+    report: ReportCreate,
+    user_id: str = Depends(get_current_user_id)
+):
+    if report.period == ReportPeriod.MONTHLY and report.month is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Monthly reports need a month"
+        )
+    if report.period == ReportPeriod.ANNUAL:
+        report.month = None
+
+    db = await get_user_database(user_id)
+    job = await report_jobs.submit(db, user_id, report)
+    return serialize_document(job)
+
+
+@app.get(
+    "/reports/{report_id}",
+    response_model=ReportResponse,
+    tags=["Reports"]
+)
+async def get_report(
+    report_id: str,
+    user_id: str = Depends(get_current_user_id)
+):
+    db = await get_user_database(user_id)
+    return serialize_document(await require_report(db, user_id, report_id))
+
+
+@app.get(
+    "/reports/{report_id}/download",
+    tags=["Reports"]
+)
+async def download_report(
+    report_id: str,
+    user_id: str = Depends(get_current_user_id)
+):
+    db = await get_user_database(user_id)
+    report = await require_report(db, user_id, report_id)
+
+    if report["status"] != ReportStatus.DONE:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Report is {report['status']}"
+        )
+    if not os.path.exists(report["path"]):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report file has expired"
+        )
+
+    return FileResponse(
+        report["path"],
+        media_type=REPORT_MEDIA_TYPES[report["format"]],
+        filename=f"statement-{report['key'].split(':')[1]}.{report['format']}"
+    )
@@ -0,0 +1,114 @@
+"""Convert legacy transaction documents to the compact layout in ``schema.py``.
+
+Usage:
+    python migrate_schema.py [--batch-size 1000] [--pause 0.05] [--stats]
+
+Legacy documents (those still carrying a ``user_id`` field) are rewritten in
+``_id`` order, one ``bulk_write`` per batch, pausing between batches so the
+API keeps serving requests while it runs. Each replacement is conditional on
+the document still being in the legacy layout, which makes the tool safe to
+interrupt and re-run.
+
+The API converts a user's remaining legacy documents itself the first time a
+worker serves that user (see ``schema.LegacyTransactions``), so nobody sees a
+half-migrated transaction list while this tool works through the collection.
+During a rolling deploy, instances still running the old version keep writing
+legacy documents; run the tool again once they are gone. It exits non-zero
+while any legacy documents are left.
+
+With ``--stats`` the collection size, index size and summary aggregation time
+are measured before and after the migration.
+"""
+import argparse
+import asyncio
+import time
+
+from database import get_database
+from schema import LEGACY_FILTER, convert_legacy_transactions, owner_filter
+
+
+async def collection_stats(db) -> dict:
+    stats = await db.database.command("collStats", "transactions")
+    return {
+        "count": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "storage_size": stats.get("storageSize", 0),
+        "index_size": stats.get("totalIndexSize", 0),
+    }
+
+
+async def time_summaries(db, user_ids, legacy: bool) -> float:
+    started = time.perf_counter()
+    for user_id in user_ids:
+        if legacy:
+            pipeline = [
+                {"$match": {"user_id": user_id}},
+                {"$group": {"_id": "$type", "total": {"$sum": "$amount"}}}
+            ]
+        else:
+            pipeline = [
+                {"$match": owner_filter(user_id)},
+                {"$group": {"_id": "$t", "total": {"$sum": "$a"}}}
+            ]
+        await db.transaction_collection.aggregate(pipeline).to_list(None)
+    return time.perf_counter() - started
+
+
+async def measure(db, user_ids, legacy: bool) -> dict:
+    stats = await collection_stats(db)
+    stats["summary_seconds"] = round(await time_summaries(db, user_ids, legacy), 4)
+    return stats
+
+
+async def migrate(db, batch_size: int, pause: float) -> int:
+    migrated = 0
+    last_id = None
+
+    while True:
+        query = dict(LEGACY_FILTER)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+
+        batch = await db.transaction_collection.find(query).sort("_id", 1).limit(batch_size).to_list(None)
+        if not batch:
+            break
+
+        migrated += await convert_legacy_transactions(db, batch)
+        last_id = batch[-1]["_id"]
+        print(f"migrated {migrated} transactions (last _id {last_id})")
+
+        if pause:
+            await asyncio.sleep(pause)
+
+    return migrated
+
+
+async def main(args):
+    db = get_database()
+    await db.ensure_indexes()
+
+    user_ids = []
+    if args.stats:
+        async for user in db.user_collection.find({}, {"_id": 1}).limit(args.sample_users):
+            user_ids.append(str(user["_id"]))
+        print("before:", await measure(db, user_ids, legacy=True))
+
+    migrated = await migrate(db, args.batch_size, args.pause)
+    remaining = await db.transaction_collection.count_documents(LEGACY_FILTER)
+    print(f"done, {migrated} transactions converted, {remaining} legacy documents left")
+
+    if args.stats:
+        print("after:", await measure(db, user_ids, legacy=False))
+
+    await db.close()
+    if remaining:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--stats", action="store_true", help="measure sizes and aggregation time before and after")
+    parser.add_argument("--sample-users", type=int, default=100, help="users timed by --stats")
+    asyncio.run(main(parser.parse_args()))
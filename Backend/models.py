@@ -1,7 +1,8 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field, EmailStr, TypeAdapter, create_model
+from typing import List, Optional, Tuple
 from datetime import datetime, timezone
 from enum import Enum
+from functools import lru_cache
 
 
 def get_utc_now():
@@ -37,6 +38,11 @@ class UserResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 
 class TransactionBase(BaseModel):
@@ -45,6 +51,7 @@ class TransactionBase(BaseModel):
     type: TransactionType
     category: str = Field(..., min_length=1, max_length=50)
     date: datetime = Field(default_factory=get_utc_now)
+    goal_id: Optional[str] = None
 
 
 class TransactionCreate(TransactionBase):
@@ -65,17 +72,74 @@ class TransactionResponse(TransactionBase):
                 "type": "income",
                 "category": "Job",
                 "date": "2024-01-15T10:00:00",
+                "goal_id": None,
                 "user_id": "507f1f77bcf86cd799439012"
             }
         }
 
 
+@lru_cache(maxsize=None)
+def sparse_transaction_adapter(fields: Tuple[str, ...], many: bool) -> TypeAdapter:
+    """``TransactionResponse`` trimmed to ``fields`` (plus ``id``), for ``?fields=`` reads.
+
+    ``fields`` is a sorted subset of the response fields, so the cache is bounded.
+    """
+    model = create_model(
+        "SparseTransactionResponse",
+        __config__=ConfigDict(populate_by_name=True),
+        id=(str, Field(alias="_id")),
+        **{name: (TransactionResponse.model_fields[name].annotation, ...) for name in fields}
+    )
+    return TypeAdapter(List[model] if many else model)
+
+
+class BudgetAlert(BaseModel):
+    budget_id: str
+    category: str
+    period: str
+    period_key: str
+    limit_amount: float
+    spent_amount: float
+
+
+class TransactionWriteResponse(TransactionResponse):
+    budget_alerts: List[BudgetAlert] = []
+
+
 class TransactionUpdate(BaseModel):
     description: Optional[str] = Field(None, min_length=1, max_length=200)
     amount: Optional[float] = Field(None, gt=0)
     type: Optional[TransactionType] = None
     category: Optional[str] = Field(None, min_length=1, max_length=50)
     date: Optional[datetime] = None
+    goal_id: Optional[str] = None
+
+
+class TransactionFilter(BaseModel):
+    ids: Optional[List[str]] = Field(None, max_length=10000)
+    category: Optional[str] = Field(None, min_length=1, max_length=50)
+    type: Optional[TransactionType] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+
+
+class BulkUpdateRequest(BaseModel):
+    filter: TransactionFilter
+    update: TransactionUpdate = Field(alias="$set")
+
+    class Config:
+        populate_by_name = True
+
+
+class BulkDeleteRequest(BaseModel):
+    filter: TransactionFilter
+
+
+class BulkOperationResponse(BaseModel):
+    matched_count: int
+    modified_count: int = 0
+    deleted_count: int = 0
+    budget_alerts: List[BudgetAlert] = []
 
 
 class SummaryResponse(BaseModel):
@@ -85,6 +149,31 @@ class SummaryResponse(BaseModel):
     transaction_count: int
 
 
+class CategorySuggestion(BaseModel):
+    name: str
+    count: int
+
+
+class MonthlyTrend(BaseModel):
+    month: str
+    income: float
+    expense: float
+    expense_rolling_average: Optional[float] = None
+
+
+class CategoryShare(BaseModel):
+    category: str
+    amount: float
+    share: float
+
+
+class AnalyticsResponse(BaseModel):
+    months: List[MonthlyTrend]
+    categories: List[CategoryShare]
+    expense_percentiles: dict
+    outlier_transaction_ids: List[str]
+
+
 # Recurring Transactions Models
 class FrequencyType(str, Enum):
     DAILY = "daily"
@@ -164,6 +253,90 @@ class GoalResponse(GoalBase):
     id: str = Field(alias="_id")
     user_id: str
     created_at: datetime
+    tagged_amount: float = 0
+
+    class Config:
+        populate_by_name = True
+
+
+class GoalContributionCreate(BaseModel):
+    amount: float = Field(..., gt=0)
+    note: Optional[str] = Field(None, max_length=200)
+    date: datetime = Field(default_factory=get_utc_now)
+
+
+class GoalContributionResponse(GoalContributionCreate):
+    id: str = Field(alias="_id")
+    goal_id: str
+    user_id: str
+
+    class Config:
+        populate_by_name = True
+
+
+# Budgets Models
+class BudgetPeriod(str, Enum):
+    WEEKLY = "weekly"
+    MONTHLY = "monthly"
+    YEARLY = "yearly"
+
+
+class BudgetCreate(BaseModel):
+    category: str = Field(..., min_length=1, max_length=50)
+    period: BudgetPeriod = BudgetPeriod.MONTHLY
+    limit_amount: float = Field(..., gt=0)
+
+
+class BudgetUpdate(BaseModel):
+    limit_amount: float = Field(..., gt=0)
+
+
+class BudgetResponse(BudgetCreate):
+    id: str = Field(alias="_id")
+    user_id: str
+    created_at: datetime
+    period_key: str
+    spent_amount: float
+    remaining_amount: float
+    is_over_budget: bool
+
+    class Config:
+        populate_by_name = True
+
+
+# Report Models
+class ReportPeriod(str, Enum):
+    MONTHLY = "monthly"
+    ANNUAL = "annual"
+
+
+class ReportFormat(str, Enum):
+    CSV = "csv"
+    PDF = "pdf"
+
+
+class ReportStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class ReportCreate(BaseModel):
+    period: ReportPeriod = ReportPeriod.MONTHLY
+    year: int = Field(..., ge=1900, le=2100)
+    month: Optional[int] = Field(None, ge=1, le=12)
+    format: ReportFormat = ReportFormat.CSV
+
+
+class ReportResponse(ReportCreate):
+    id: str = Field(alias="_id")
+    status: ReportStatus
+    transaction_count: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    expires_at: datetime
 
     class Config:
         populate_by_name = True
@@ -0,0 +1,196 @@
+"""Move users between shards while the API keeps serving everyone else.
+
+Usage:
+    python rebalance.py move <user_id> <shard>   # e.g. shard2
+    python rebalance.py rebalance [--dry-run]    # move users to their hash-ring shard
+
+A move copies the user's documents to the target shard while they keep
+working, then marks them ``moving`` in the directory. Their requests get a
+503 with ``Retry-After`` from then on. The tool waits out every worker's
+placement cache, then for work that resolved the source shard earlier and is
+still running: report jobs until they finish, everything else (bulk
+operations, batched inserts) until a re-copy pass finds nothing new on the
+source. Only then does it flip the directory entry and delete the source
+copy.
+
+``rebalance`` is meant to run after adding a shard to ``SHARD_URLS``. Consistent
+hashing means only the users whose ring position now belongs to the new
+shard are moved. Users registered before sharding count as being on
+``shard0``.
+"""
+import argparse
+import asyncio
+import re
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import DeleteOne, ReplaceOne
+
+from database import get_database
+from reports import REPORT_JOB_TIMEOUT_SECONDS
+from schema import legacy_transactions
+
+
+COPY_BATCH_SIZE = 500
+# Pause between re-copy passes; a pass with no changes after it means the
+# source has stopped receiving writes.
+MOVE_SETTLE_SECONDS = 2
+
+
+def user_scoped_collections(shard, user_id: str):
+    """Every (collection, owner filter) pair holding data for ``user_id``."""
+    user_oid = ObjectId(user_id)
+    return [
+        (shard.user_collection, {"_id": user_oid}),
+        (shard.transaction_collection, {"u": user_oid}),
+        (shard.transaction_archive_collection, {"u": user_oid}),
+        (shard.user_category_collection, {"u": user_oid}),
+        (shard.recurring_transaction_collection, {"user_id": user_id}),
+        (shard.goal_collection, {"user_id": user_id}),
+        (shard.budget_collection, {"user_id": user_id}),
+        (shard.budget_event_collection, {"user_id": user_id}),
+        (shard.report_job_collection, {"user_id": user_id}),
+        (shard.idempotency_collection, {"_id": {"$regex": f"^{re.escape(user_id)}:"}}),
+    ]
+
+
+async def copy_user(source, target, user_id: str, prune: bool) -> int:
+    """Upsert the user's documents from ``source`` into ``target``.
+
+    With ``prune``, target documents that no longer exist on the source are
+    deleted too, so a second pass converges on an exact copy. Returns how
+    many target documents changed.
+    """
+    changed = 0
+    pairs = zip(user_scoped_collections(source, user_id), user_scoped_collections(target, user_id))
+
+    for (source_collection, owner), (target_collection, _) in pairs:
+        seen = set()
+        batch = []
+        async for doc in source_collection.find(owner):
+            seen.add(doc["_id"])
+            batch.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+            if len(batch) >= COPY_BATCH_SIZE:
+                changed += _changes(await target_collection.bulk_write(batch, ordered=False))
+                batch = []
+        if batch:
+            changed += _changes(await target_collection.bulk_write(batch, ordered=False))
+
+        if prune:
+            stale = [
+                DeleteOne({"_id": doc["_id"]})
+                async for doc in target_collection.find(owner, {"_id": 1})
+                if doc["_id"] not in seen
+            ]
+            if stale:
+                changed += _changes(await target_collection.bulk_write(stale, ordered=False))
+
+    return changed
+
+
+def _changes(result) -> int:
+    return result.upserted_count + result.modified_count + result.deleted_count
+
+
+async def wait_for_reports(source, user_id: str):
+    """Report jobs write their outcome to the shard they were submitted on."""
+    while True:
+        # Older jobs lost their worker; the report cleanup fails them.
+        since = datetime.now(timezone.utc) - timedelta(seconds=REPORT_JOB_TIMEOUT_SECONDS)
+        running = await source.report_job_collection.count_documents(
+            {"user_id": user_id, "active": True, "created_at": {"$gte": since}}
+        )
+        if not running:
+            return
+        await asyncio.sleep(MOVE_SETTLE_SECONDS)
+
+
+async def move_user(db, user_id: str, target_name: str):
+    entry = await db.directory_collection.find_one({"_id": user_id})
+    source_name = entry["shard"] if entry else db.default_shard
+    if source_name == target_name:
+        return
+
+    source, target = db.shards[source_name], db.shards[target_name]
+
+    if entry is None:
+        # Users registered before sharding: record them before their data moves.
+        user = await source.user_collection.find_one({"_id": ObjectId(user_id)}, {"email": 1})
+        await db.directory_collection.update_one(
+            {"_id": user_id},
+            {"$setOnInsert": {"email": user["email"], "shard": source_name}},
+            upsert=True
+        )
+
+    # The copy selects transactions by ``u``, which legacy documents lack.
+    await legacy_transactions.convert_user(source, user_id)
+    await copy_user(source, target, user_id, prune=False)
+
+    await db.directory_collection.update_one(
+        {"_id": user_id},
+        {"$set": {"moving": True}}
+    )
+    # Let every worker's placement cache observe the moving flag.
+    await asyncio.sleep(db.settings.shard_cache_seconds * 2)
+
+    await wait_for_reports(source, user_id)
+    # Requests that resolved the source shard before the flag may still write
+    # to it: re-copy until a pass a full settle period later finds nothing new.
+    await copy_user(source, target, user_id, prune=True)
+    while True:
+        await asyncio.sleep(MOVE_SETTLE_SECONDS)
+        if not await copy_user(source, target, user_id, prune=True):
+            break
+    await db.directory_collection.update_one(
+        {"_id": user_id},
+        {"$set": {"shard": target_name}, "$unset": {"moving": ""}}
+    )
+
+    for collection, owner in user_scoped_collections(source, user_id):
+        await collection.delete_many(owner)
+
+    print(f"moved {user_id}: {source_name} -> {target_name}")
+
+
+async def rebalance(db, dry_run: bool):
+    for shard in db.shards.values():
+        async for user in shard.user_collection.find({}, {"_id": 1}):
+            user_id = str(user["_id"])
+            entry = await db.directory_collection.find_one({"_id": user_id}, {"shard": 1})
+            current = entry["shard"] if entry else db.default_shard
+            if current != shard.name:
+                # A leftover copy from an interrupted move; the directory is authoritative.
+                continue
+
+            wanted = db.ring.node_for(user_id)
+            if wanted == current:
+                continue
+            if dry_run:
+                print(f"would move {user_id}: {current} -> {wanted}")
+            else:
+                await move_user(db, user_id, wanted)
+
+
+async def main(args):
+    db = get_database()
+    await db.ensure_indexes()
+
+    if args.command == "move":
+        if args.shard not in db.shards:
+            raise SystemExit(f"unknown shard {args.shard}; configured: {', '.join(db.shards)}")
+        await move_user(db, args.user_id, args.shard)
+    else:
+        await rebalance(db, args.dry_run)
+
+    await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move users between MongoDB shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    move = commands.add_parser("move", help="move one user to a shard")
+    move.add_argument("user_id")
+    move.add_argument("shard")
+    balance = commands.add_parser("rebalance", help="move every user to their hash-ring shard")
+    balance.add_argument("--dry-run", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,114 @@
+"""Rotating refresh tokens.
+
+Login hands out a short-lived JWT access token plus an opaque refresh token.
+``POST /auth/refresh`` trades the refresh token for a new pair without
+touching the password hash. Tokens are stored in the directory database,
+since the caller's shard isn't known yet, as
+
+    {"_id": sha256(token), "user_id": str, "family": str,
+     "expires_at": datetime, "used_at": datetime}
+
+Tokens are random 256-bit values, so a plain SHA-256 is enough to keep a
+database leak from yielding usable tokens. A rotation is a single
+``find_one_and_update`` on ``_id`` that marks the token used. Every token
+descends from one login (its ``family``).
+
+A replacement is derived from the token it replaces with an HMAC, so for
+``REUSE_GRACE_SECONDS`` after a rotation the spent token yields the same
+replacement again. That covers several tabs refreshing the same session at
+once. Presenting a spent token after the grace window means it was copied,
+so the whole family is revoked and both parties have to log in again.
+
+A TTL index drops tokens after ``Settings.refresh_token_days``, and a
+password change revokes all of the user's tokens.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ReturnDocument
+
+from auth import SECRET_KEY
+
+
+REUSE_GRACE_SECONDS = 30
+
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _successor(token: str) -> str:
+    digest = hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _invalid() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired refresh token"
+    )
+
+
+class RefreshTokenStore:
+    async def issue(
+        self,
+        db,
+        user_id: str,
+        family: Optional[str] = None,
+        token: Optional[str] = None
+    ) -> str:
+        token = token or secrets.token_urlsafe(32)
+        await db.refresh_token_collection.insert_one({
+            "_id": _hash(token),
+            "user_id": user_id,
+            "family": family or str(ObjectId()),
+            "expires_at": datetime.now(timezone.utc) + timedelta(days=db.settings.refresh_token_days)
+        })
+        return token
+
+    async def rotate(self, db, token: str) -> Tuple[str, str]:
+        """Spend ``token`` and return ``(user_id, next refresh token)``."""
+        now = datetime.now(timezone.utc)
+        record = await db.refresh_token_collection.find_one_and_update(
+            {"_id": _hash(token), "used_at": {"$exists": False}, "expires_at": {"$gt": now}},
+            {"$set": {"used_at": now}},
+            projection={"user_id": 1, "family": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if record is None:
+            spent = await db.refresh_token_collection.find_one(
+                {"_id": _hash(token)}, {"user_id": 1, "family": 1, "used_at": 1}
+            )
+            if spent is None or "used_at" not in spent:
+                raise _invalid()
+            if now - _as_utc(spent["used_at"]) <= timedelta(seconds=REUSE_GRACE_SECONDS):
+                # Another tab rotated this token a moment ago: hand out the same replacement.
+                return spent["user_id"], _successor(token)
+            await db.refresh_token_collection.delete_many({"family": spent["family"]})
+            raise _invalid()
+
+        successor = _successor(token)
+        await self.issue(db, record["user_id"], record["family"], successor)
+        return record["user_id"], successor
+
+    async def revoke(self, db, token: str):
+        """Log one session out: drop every token descended from the same login."""
+        record = await db.refresh_token_collection.find_one({"_id": _hash(token)}, {"family": 1})
+        if record is not None:
+            await db.refresh_token_collection.delete_many({"family": record["family"]})
+
+    async def revoke_user(self, db, user_id: str):
+        await db.refresh_token_collection.delete_many({"user_id": user_id})
+
+
+refresh_tokens = RefreshTokenStore()
@@ -0,0 +1,429 @@
+"""Monthly and annual statements rendered off the event loop.
+
+``POST /reports`` records a job in the ``report_jobs`` collection and hands it
+to a process pool; ``GET /reports/{id}`` polls it and
+``GET /reports/{id}/download`` serves the finished file from
+``Settings.report_dir``. A job document:
+
+    {"user_id": str, "period": "monthly", "year": int, "month": int | None,
+     "format": "csv" | "pdf", "key": "monthly:2024-05:csv",
+     "status": "queued" | "running" | "done" | "failed",
+     "active": True (only while queued or running), "slot": int, "path": str,
+     "transaction_count": int, "error": str, "created_at": datetime,
+     "finished_at": datetime, "expires_at": datetime}
+
+A unique partial index on ``(user_id, key)`` over active jobs collapses
+identical requests onto the job already in flight, and a user may have at
+most ``Settings.report_max_active_per_user`` active jobs, each holding a
+numbered ``slot`` under a second unique partial index. Workers open their
+own synchronous client and stream the period's hot and archived transactions
+in date order, so memory stays flat however large the account. Transactions
+come first in the file and the category and monthly summary last, which lets
+both renderers write in a single pass. Jobs and their files are purged once
+``expires_at`` passes.
+"""
+import asyncio
+import csv
+import heapq
+import logging
+import multiprocessing
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import DuplicateKeyError
+from reportlab.graphics import renderPDF
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.charts.piecharts import Pie
+from reportlab.graphics.shapes import Drawing
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from models import ReportCreate, ReportFormat, ReportPeriod, ReportStatus, TransactionType
+from schema import TYPE_CODES, TYPE_NAMES, from_cents
+
+
+# Jobs still active after this long lost their worker (e.g. a restart).
+REPORT_JOB_TIMEOUT_SECONDS = 15 * 60
+CLEANUP_INTERVAL_SECONDS = 10 * 60
+STREAM_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+EXPENSE = TYPE_CODES[TransactionType.EXPENSE]
+
+
+def report_key(report: ReportCreate) -> str:
+    month = f"-{report.month:02d}" if report.period == ReportPeriod.MONTHLY else ""
+    return f"{report.period.value}:{report.year}{month}:{report.format.value}"
+
+
+def period_range(period: ReportPeriod, year: int, month: Optional[int]) -> Tuple[datetime, datetime]:
+    if period == ReportPeriod.MONTHLY:
+        return datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+
+# ============================================
+# WORKER PROCESS
+# ============================================
+
+_worker_clients: Dict[str, MongoClient] = {}
+
+
+def _client(url: str) -> MongoClient:
+    if url not in _worker_clients:
+        _worker_clients[url] = MongoClient(url)
+    return _worker_clients[url]
+
+
+class CategoryNames(dict):
+    """Category code -> name, looked up in the global dictionary on first use."""
+
+    def __init__(self, collection):
+        super().__init__()
+        self.collection = collection
+
+    def __missing__(self, code: int) -> str:
+        doc = self.collection.find_one({"_id": code})
+        self[code] = doc["n"] if doc else str(code)
+        return self[code]
+
+
+class StatementTotals:
+    def __init__(self):
+        self.count = 0
+        self.income = 0
+        self.expense = 0
+        self.expense_by_category = Counter()
+        # "YYYY-MM" -> [income cents, expense cents]
+        self.by_month = defaultdict(lambda: [0, 0])
+
+    def add(self, doc: dict) -> dict:
+        self.count += 1
+        month = self.by_month[doc["dt"].strftime("%Y-%m")]
+        if doc["t"] == EXPENSE:
+            self.expense += doc["a"]
+            self.expense_by_category[doc["c"]] += doc["a"]
+            month[1] += doc["a"]
+        else:
+            self.income += doc["a"]
+            month[0] += doc["a"]
+        return doc
+
+
+def stream_transactions(database, user_oid: ObjectId, start: datetime, end: datetime) -> Iterator[dict]:
+    """The user's hot and archived transactions in ``[start, end)``, oldest first."""
+    hot = database.transactions.find(
+        {"u": user_oid, "dt": {"$gte": start, "$lt": end}}
+    ).sort("dt", ASCENDING).batch_size(STREAM_BATCH_SIZE)
+
+    def cold():
+        buckets = database.transaction_archive.find(
+            {"u": user_oid, "m": {"$gte": start, "$lt": end}}, {"tx": 1}
+        ).sort("m", ASCENDING)
+        for bucket in buckets:
+            yield from sorted(bucket.get("tx", []), key=lambda doc: doc["dt"])
+
+    return heapq.merge(cold(), hot, key=lambda doc: doc["dt"])
+
+
+def row_values(doc: dict, names: Dict[int, str]) -> list:
+    return [
+        doc["dt"].strftime("%Y-%m-%d"),
+        TYPE_NAMES[doc["t"]].value,
+        names[doc["c"]],
+        doc.get("d", ""),
+        f"{from_cents(doc['a']):.2f}",
+    ]
+
+
+def category_rows(totals: StatementTotals, names: Dict[int, str]) -> Iterator[list]:
+    for code, cents in totals.expense_by_category.most_common():
+        yield [names[code], f"{from_cents(cents):.2f}", f"{cents / totals.expense:.1%}"]
+
+
+def write_csv(path: str, rows: Iterable[dict], totals: StatementTotals, names: Dict[int, str], title: str):
+    with open(path, "w", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow([title])
+        writer.writerow(["date", "type", "category", "description", "amount"])
+        for doc in rows:
+            writer.writerow(row_values(doc, names))
+
+        writer.writerow([])
+        writer.writerow(["category", "expense", "share"])
+        writer.writerows(category_rows(totals, names))
+
+        writer.writerow([])
+        writer.writerow(["month", "income", "expense"])
+        for month, (income, expense) in sorted(totals.by_month.items()):
+            writer.writerow([month, f"{from_cents(income):.2f}", f"{from_cents(expense):.2f}"])
+        writer.writerow(["total", f"{from_cents(totals.income):.2f}", f"{from_cents(totals.expense):.2f}"])
+
+
+PDF_MARGIN = 40
+PDF_LINE_HEIGHT = 14
+PDF_COLUMNS = (0, 70, 130, 240, 515)
+PIE_SLICES = 8
+
+
+def write_pdf(path: str, rows: Iterable[dict], totals: StatementTotals, names: Dict[int, str], title: str):
+    width, height = A4
+    pdf = canvas.Canvas(path, pagesize=A4)
+    pdf.setTitle(title)
+    cursor = {"y": 0}
+
+    def new_page():
+        pdf.setFont("Helvetica-Bold", 14)
+        pdf.drawString(PDF_MARGIN, height - PDF_MARGIN, title)
+        pdf.setFont("Helvetica", 9)
+        cursor["y"] = height - PDF_MARGIN - 2 * PDF_LINE_HEIGHT
+
+    def line(values, columns=PDF_COLUMNS):
+        if cursor["y"] < PDF_MARGIN:
+            pdf.showPage()
+            new_page()
+        # The last column holds amounts and is right-aligned.
+        for x, value in zip(columns[:-1], values[:-1]):
+            pdf.drawString(PDF_MARGIN + x, cursor["y"], str(value)[:45])
+        pdf.drawRightString(PDF_MARGIN + columns[-1], cursor["y"], values[-1])
+        cursor["y"] -= PDF_LINE_HEIGHT
+
+    new_page()
+    line(["Date", "Type", "Category", "Description", "Amount"])
+    for doc in rows:
+        line(row_values(doc, names))
+
+    pdf.showPage()
+    new_page()
+    line(["Total income", f"{from_cents(totals.income):.2f}"], (0, 200))
+    line(["Total expense", f"{from_cents(totals.expense):.2f}"], (0, 200))
+    line(["Transactions", str(totals.count)], (0, 200))
+
+    if totals.by_month:
+        months = sorted(totals.by_month)
+        chart = VerticalBarChart()
+        chart.x, chart.y = 40, 20
+        chart.width, chart.height = width - 2 * PDF_MARGIN - 60, 150
+        chart.data = [
+            [from_cents(totals.by_month[month][0]) for month in months],
+            [from_cents(totals.by_month[month][1]) for month in months],
+        ]
+        chart.categoryAxis.categoryNames = months
+        chart.categoryAxis.labels.angle = 45 if len(months) > 6 else 0
+        chart.bars[0].fillColor = colors.seagreen
+        chart.bars[1].fillColor = colors.indianred
+        drawing = Drawing(width - 2 * PDF_MARGIN, 190)
+        drawing.add(chart)
+        cursor["y"] -= 190
+        renderPDF.draw(drawing, pdf, PDF_MARGIN, cursor["y"])
+
+    if totals.expense > 0:
+        top = totals.expense_by_category.most_common()
+        slices = top[:PIE_SLICES]
+        other = sum(cents for _, cents in top[PIE_SLICES:])
+        pie = Pie()
+        pie.x, pie.y, pie.width, pie.height = 150, 10, 160, 160
+        pie.data = [from_cents(cents) for _, cents in slices] + ([from_cents(other)] if other else [])
+        pie.labels = [names[code] for code, _ in slices] + (["Other"] if other else [])
+        drawing = Drawing(width - 2 * PDF_MARGIN, 180)
+        drawing.add(pie)
+        cursor["y"] -= 190
+        renderPDF.draw(drawing, pdf, PDF_MARGIN, cursor["y"])
+        cursor["y"] -= PDF_LINE_HEIGHT
+
+        category_columns = (0, 200, 280)
+        line(["Category", "Expense", "Share"], category_columns)
+        for values in category_rows(totals, names):
+            line(values, category_columns)
+
+    pdf.showPage()
+    pdf.save()
+
+
+RENDERERS = {
+    ReportFormat.CSV: write_csv,
+    ReportFormat.PDF: write_pdf,
+}
+
+
+def render_report(spec: dict) -> int:
+    """Process-pool entry point: write the report described by ``spec``.
+
+    The file is written next to its final path and renamed into place, so a
+    download never sees a partial report. Returns the transaction count.
+    """
+    shard = _client(spec["shard_url"])[spec["database_name"]]
+    directory = _client(spec["directory_url"])[spec["database_name"]]
+    period = ReportPeriod(spec["period"])
+    start, end = period_range(period, spec["year"], spec["month"])
+
+    totals = StatementTotals()
+    rows = (totals.add(doc) for doc in stream_transactions(shard, ObjectId(spec["user_id"]), start, end))
+    names = CategoryNames(directory.category_codes)
+    label = start.strftime("%B %Y") if period == ReportPeriod.MONTHLY else str(spec["year"])
+
+    partial = f"{spec['path']}.part"
+    RENDERERS[ReportFormat(spec["format"])](partial, rows, totals, names, f"Statement for {label}")
+    os.replace(partial, spec["path"])
+    return totals.count
+
+
+# ============================================
+# API PROCESS
+# ============================================
+
+class ReportJobs:
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cleanup: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def _pool(self, settings) -> ProcessPoolExecutor:
+        if self._executor is None:
+            os.makedirs(settings.report_dir, exist_ok=True)
+            # Spawned, not forked: the API process runs Motor's threads.
+            self._executor = ProcessPoolExecutor(
+                max_workers=settings.report_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def start(self, db_manager):
+        self._cleanup = asyncio.create_task(self._cleanup_loop(db_manager))
+
+    async def stop(self):
+        if self._cleanup is not None:
+            self._cleanup.cancel()
+            self._cleanup = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, db, user_id: str, report: ReportCreate) -> dict:
+        """Enqueue ``report``, or return the identical job already in flight."""
+        key = report_key(report)
+        collection = db.report_job_collection
+
+        existing = await collection.find_one({"user_id": user_id, "key": key, "active": True})
+        if existing is not None:
+            return existing
+
+        now = datetime.now(timezone.utc)
+        job = report.model_dump()
+        job.update({
+            "user_id": user_id,
+            "key": key,
+            "status": ReportStatus.QUEUED,
+            "active": True,
+            "created_at": now,
+            "expires_at": now + timedelta(hours=db.settings.report_ttl_hours)
+        })
+        # Each active job holds one of the user's slots, unique over active
+        # jobs, so concurrent submits cannot overshoot the cap.
+        for slot in range(db.settings.report_max_active_per_user):
+            job.pop("_id", None)
+            job["slot"] = slot
+            try:
+                result = await collection.insert_one(job)
+                break
+            except DuplicateKeyError as exc:
+                if "key" in (exc.details or {}).get("keyPattern", {}):
+                    # An identical request won the race; it may even have finished already.
+                    return await self.submit(db, user_id, report)
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many reports in progress; wait for one to finish"
+            )
+
+        job["_id"] = result.inserted_id
+        task = asyncio.create_task(self._run(db, job))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return job
+
+    async def _run(self, db, job: dict):
+        collection = db.report_job_collection
+        path = os.path.join(db.settings.report_dir, f"{job['_id']}.{job['format'].value}")
+        spec = {
+            "shard_url": db.url,
+            "directory_url": db.settings.mongodb_url,
+            "database_name": db.settings.database_name,
+            "user_id": job["user_id"],
+            "period": job["period"].value,
+            "year": job["year"],
+            "month": job["month"],
+            "format": job["format"].value,
+            "path": path
+        }
+
+        await collection.update_one({"_id": job["_id"]}, {"$set": {"status": ReportStatus.RUNNING}})
+        try:
+            loop = asyncio.get_running_loop()
+            count = await loop.run_in_executor(self._pool(db.settings), render_report, spec)
+        except Exception as exc:
+            await collection.update_one(
+                {"_id": job["_id"]},
+                {
+                    "$set": {
+                        "status": ReportStatus.FAILED,
+                        "error": str(exc) or type(exc).__name__,
+                        "finished_at": datetime.now(timezone.utc)
+                    },
+                    "$unset": {"active": ""}
+                }
+            )
+            return
+
+        await collection.update_one(
+            {"_id": job["_id"]},
+            {
+                "$set": {
+                    "status": ReportStatus.DONE,
+                    "path": path,
+                    "transaction_count": count,
+                    "finished_at": datetime.now(timezone.utc)
+                },
+                "$unset": {"active": ""}
+            }
+        )
+
+    async def purge_expired(self, db_manager) -> int:
+        """Delete expired jobs with their files, and fail jobs whose worker died."""
+        now = datetime.now(timezone.utc)
+        purged = 0
+        for shard in db_manager.shards.values():
+            collection = shard.report_job_collection
+            async for job in collection.find({"expires_at": {"$lt": now}}, {"path": 1}):
+                if job.get("path") and os.path.exists(job["path"]):
+                    os.remove(job["path"])
+                await collection.delete_one({"_id": job["_id"]})
+                purged += 1
+
+            await collection.update_many(
+                {"active": True, "created_at": {"$lt": now - timedelta(seconds=REPORT_JOB_TIMEOUT_SECONDS)}},
+                {
+                    "$set": {"status": ReportStatus.FAILED, "error": "Report job timed out"},
+                    "$unset": {"active": ""}
+                }
+            )
+        return purged
+
+    async def _cleanup_loop(self, db_manager):
+        while True:
+            try:
+                await self.purge_expired(db_manager)
+            except Exception:
+                logger.exception("Report cleanup failed")
+            await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
+
+
+report_jobs = ReportJobs()
@@ -0,0 +1,259 @@
+"""Compact on-disk layout for transaction documents.
+
+The API keeps speaking ``TransactionCreate`` / ``TransactionResponse``; only the
+stored document changes shape:
+
+    {"_id": ObjectId, "u": ObjectId, "d": str, "a": int64 cents,
+     "t": int, "c": int category code, "dt": datetime, "g": ObjectId}
+
+``g`` (the goal a transaction is tagged with) is only present when set.
+
+Category names are dictionary-encoded into small integers shared by every
+user, so repeated strings like "Groceries" are stored once.
+
+Documents still in the legacy layout (API field names, ``user_id`` as a
+string) are converted per user before the API first reads that user's
+transactions, while ``migrate_schema.py`` converts everyone else in the
+background.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from bson.int64 import Int64
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from models import TransactionType
+
+
+FIELD_KEYS = {
+    "user_id": "u",
+    "description": "d",
+    "amount": "a",
+    "type": "t",
+    "category": "c",
+    "date": "dt",
+    "goal_id": "g",
+}
+
+TRANSACTION_FIELDS = tuple(FIELD_KEYS)
+
+TYPE_CODES = {
+    TransactionType.INCOME: 0,
+    TransactionType.EXPENSE: 1,
+}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+
+def to_cents(amount: float) -> int:
+    return int(Decimal(str(amount)).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> float:
+    return cents / 100
+
+
+def to_utc(value: datetime) -> datetime:
+    """Naive UTC, the form MongoDB hands dates back in."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def owner_filter(user_id: str) -> dict:
+    return {FIELD_KEYS["user_id"]: ObjectId(user_id)}
+
+
+def encode_transaction(data: dict, category_code: Optional[int] = None) -> dict:
+    """Map API field names onto storage keys.
+
+    Works on partial dicts too, so it serves both inserts and ``$set`` patches.
+    ``category_code`` must be supplied whenever ``data`` carries a category.
+    """
+    doc = {}
+    for field, value in data.items():
+        key = FIELD_KEYS.get(field)
+        if key is None:
+            continue
+        if field == "user_id":
+            value = ObjectId(value)
+        elif field == "goal_id":
+            value = ObjectId(value) if value is not None else None
+        elif field == "amount":
+            value = Int64(to_cents(value))
+        elif field == "type":
+            value = TYPE_CODES[TransactionType(value)]
+        elif field == "date":
+            value = to_utc(value)
+        elif field == "category":
+            if category_code is None:
+                raise ValueError("category_code is required to encode a category")
+            value = category_code
+        doc[key] = value
+    return doc
+
+
+def decode_transaction(
+    doc: dict,
+    category: Optional[str],
+    fields: Iterable[str] = TRANSACTION_FIELDS
+) -> dict:
+    """Inverse of ``encode_transaction``, limited to ``fields`` for sparse reads."""
+    decoded = {"_id": str(doc["_id"])}
+    for field in fields:
+        value = doc.get(FIELD_KEYS[field])
+        if field == "user_id":
+            value = str(value)
+        elif field == "goal_id":
+            value = str(value) if value is not None else None
+        elif field == "amount":
+            value = from_cents(value)
+        elif field == "type":
+            value = TYPE_NAMES[value]
+        elif field == "category":
+            value = category
+        decoded[field] = value
+    return decoded
+
+
+def transaction_projection(fields: Iterable[str]) -> dict:
+    """Projection for the stored keys behind ``fields``; ``dt`` is kept for sorting."""
+    return {"dt": 1, **{FIELD_KEYS[field]: 1 for field in fields}}
+
+
+def update_operations(patch: dict) -> dict:
+    """Turn an encoded patch into ``$set``/``$unset`` so a cleared goal leaves no key."""
+    operations = {}
+    to_set = {key: value for key, value in patch.items() if not (key == "g" and value is None)}
+    if to_set:
+        operations["$set"] = to_set
+    if "g" in patch and patch["g"] is None:
+        operations["$unset"] = {"g": ""}
+    return operations
+
+
+def apply_patch(doc: dict, patch: dict) -> dict:
+    """The stored document as it looks after ``update_operations(patch)``."""
+    updated = {**doc, **patch}
+    if updated.get("g", 0) is None:
+        del updated["g"]
+    return updated
+
+
+class CategoryCodes:
+    """Process-wide cache over the ``category_codes`` dictionary collection.
+
+    Codes are never reassigned, so cached entries stay valid for the life of
+    the process and only misses reach MongoDB.
+    """
+
+    def __init__(self):
+        self._by_name: Dict[str, int] = {}
+        self._by_code: Dict[int, str] = {}
+
+    def _remember(self, code: int, name: str):
+        self._by_name[name] = code
+        self._by_code[code] = name
+
+    async def encode(self, db, name: str) -> int:
+        code = await self.lookup(db, name)
+        if code is not None:
+            return code
+
+        counter = await db.counter_collection.find_one_and_update(
+            {"_id": "category_codes"},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        try:
+            await db.category_code_collection.insert_one(
+                {"_id": counter["seq"], "n": name}
+            )
+            existing = {"_id": counter["seq"], "n": name}
+        except DuplicateKeyError:
+            # Another writer registered the same name first.
+            existing = await db.category_code_collection.find_one({"n": name})
+
+        self._remember(existing["_id"], name)
+        return existing["_id"]
+
+    async def lookup(self, db, name: str) -> Optional[int]:
+        """Return the code for ``name`` without registering a new one."""
+        code = self._by_name.get(name)
+        if code is None:
+            existing = await db.category_code_collection.find_one({"n": name})
+            if existing is None:
+                return None
+            code = existing["_id"]
+            self._remember(code, name)
+        return code
+
+    async def decode_many(self, db, codes: Iterable[int]) -> Dict[int, str]:
+        wanted = set(codes)
+        missing = [code for code in wanted if code not in self._by_code]
+        if missing:
+            async for entry in db.category_code_collection.find({"_id": {"$in": missing}}):
+                self._remember(entry["_id"], entry["n"])
+        return {code: self._by_code[code] for code in wanted if code in self._by_code}
+
+    async def decode(self, db, code: int) -> str:
+        return (await self.decode_many(db, [code]))[code]
+
+
+category_codes = CategoryCodes()
+
+
+async def decode_transactions(
+    db,
+    docs: List[dict],
+    fields: Iterable[str] = TRANSACTION_FIELDS
+) -> List[dict]:
+    if "category" not in fields:
+        return [decode_transaction(doc, None, fields) for doc in docs]
+    names = await category_codes.decode_many(db, (doc["c"] for doc in docs))
+    return [decode_transaction(doc, names[doc["c"]], fields) for doc in docs]
+
+
+LEGACY_FILTER = {"user_id": {"$exists": True}}
+
+
+async def convert_legacy_transactions(db, docs: List[dict]) -> int:
+    """Rewrite legacy documents in the compact layout.
+
+    Each replacement only applies while the document is still legacy, so
+    concurrent converters of the same document are harmless.
+    """
+    operations = []
+    for doc in docs:
+        category_code = await category_codes.encode(db, doc["category"])
+        operations.append(ReplaceOne({"_id": doc["_id"], **LEGACY_FILTER}, encode_transaction(doc, category_code)))
+    if not operations:
+        return 0
+    result = await db.transaction_collection.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+class LegacyTransactions:
+    """Converts a user's legacy transactions the first time this process
+    serves them, so no route ever sees both layouts."""
+
+    def __init__(self, max_users: int = 100_000):
+        self.max_users = max_users
+        self._converted: "OrderedDict[str, None]" = OrderedDict()
+
+    async def convert_user(self, db, user_id: str):
+        if user_id in self._converted:
+            self._converted.move_to_end(user_id)
+            return
+        docs = await db.transaction_collection.find({"user_id": user_id}).to_list(None)
+        await convert_legacy_transactions(db, docs)
+        self._converted[user_id] = None
+        if len(self._converted) > self.max_users:
+            self._converted.popitem(last=False)
+
+
+legacy_transactions = LegacyTransactions()
@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+
+from analytics import UserLedger, summarize
+
+
+def make_doc(when, cents, kind=1, category=1):
+    return {"_id": ObjectId(), "dt": when, "a": cents, "t": kind, "c": category}
+
+
+def this_month(day=1):
+    now = datetime.now(timezone.utc)
+    return datetime(now.year, now.month, day)
+
+
+def test_ledger_patches_in_place():
+    docs = [make_doc(this_month(), 100 * i) for i in range(1, 40)]
+    ledger = UserLedger(docs)
+
+    ledger.remove(docs[0]["_id"])
+    ledger.upsert({**docs[5], "a": 1})
+    ledger.upsert(make_doc(this_month(), 7))
+
+    _, cents, _, _ = ledger.columns()
+    assert ledger.size == 39
+    assert sorted(cents.tolist()) == sorted([1, 7] + [100 * i for i in range(2, 40) if i != 6])
+    assert all(ledger.cents[ledger.rows[oid]] == cents[ledger.rows[oid]] for oid in ledger.ids)
+
+
+def test_summary_totals_and_outliers():
+    expenses = [make_doc(this_month(), 1000, category=1) for _ in range(20)]
+    big = make_doc(this_month(), 90000, category=2)
+    income = make_doc(this_month(), 500000, kind=0, category=3)
+    stats = summarize(UserLedger(expenses + [big, income]), months=3)
+
+    assert stats["expense_by_month"][-1] == 20 * 1000 + 90000
+    assert stats["income_by_month"][-1] == 500000
+    assert stats["category_totals"][0] == (2, 90000)
+    assert stats["outliers"] == [big["_id"]]
+    assert np.isnan(stats["expense_rolling_average"][0])
+    assert stats["expense_rolling_average"][-1] == (20 * 1000 + 90000) / 3
@@ -0,0 +1,116 @@
+import asyncio
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from bson.int64 import Int64
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from archive import (
+    archive_user,
+    cold_totals,
+    cold_transactions,
+    delete_unchanged,
+    group_by_month,
+    restore_transactions
+)
+from database import Settings
+
+
+def stored(when, cents, kind=1, user=None):
+    return {"_id": ObjectId(), "u": user or ObjectId(), "d": "x", "a": Int64(cents), "t": kind, "c": 1, "dt": when}
+
+
+class DeletingCollection:
+    def __init__(self, present):
+        self.present = set(present)
+
+    async def delete_one(self, doc):
+        found = doc["_id"] in self.present
+        self.present.discard(doc["_id"])
+        return SimpleNamespace(deleted_count=int(found))
+
+
+def test_group_by_month_strips_owner():
+    docs = [stored(datetime(2023, 1, 5), 100), stored(datetime(2023, 1, 30), 200), stored(datetime(2023, 2, 1), 300)]
+
+    buckets = group_by_month(docs)
+
+    assert sorted(buckets) == [datetime(2023, 1, 1), datetime(2023, 2, 1)]
+    assert [len(txs) for txs in buckets.values()] == [2, 1]
+    assert all("u" not in tx for txs in buckets.values() for tx in txs)
+
+
+def test_delete_unchanged_reports_only_its_own_deletes():
+    docs = [stored(datetime(2023, 1, 1), 100) for _ in range(3)]
+    collection = DeletingCollection([docs[0]["_id"], docs[2]["_id"]])
+
+    deleted = asyncio.run(delete_unchanged(collection, docs))
+
+    assert deleted == {docs[0]["_id"], docs[2]["_id"]}
+
+
+class RacingCollection:
+    """Deletes ``victim`` just before the archiver's own delete, like a user would."""
+
+    def __init__(self, real, victim):
+        self.real = real
+        self.victim = victim
+
+    def find(self, *args, **kwargs):
+        return self.real.find(*args, **kwargs)
+
+    async def delete_one(self, doc):
+        if doc["_id"] == self.victim:
+            await self.real.delete_one({"_id": self.victim})
+        return await self.real.delete_one(doc)
+
+
+async def archive_round_trip():
+    client = AsyncIOMotorClient(Settings().mongodb_url)
+    database = client[f"test_archive_{uuid.uuid4().hex}"]
+    db = SimpleNamespace(
+        transaction_collection=database.transactions,
+        transaction_archive_collection=database.transaction_archive
+    )
+    try:
+        user = ObjectId()
+        docs = [
+            stored(datetime(2022, 3, 2), 1000, kind=0, user=user),
+            stored(datetime(2022, 3, 9), 250, user=user),
+            stored(datetime(2022, 4, 1), 400, user=user),
+            stored(datetime(2099, 1, 1), 50, user=user),
+        ]
+        await database.transactions.insert_many(docs)
+
+        racing = SimpleNamespace(
+            transaction_collection=RacingCollection(database.transactions, docs[2]["_id"]),
+            transaction_archive_collection=database.transaction_archive
+        )
+        archived = await archive_user(racing, user, datetime(2023, 1, 1), batch_size=10)
+        totals = await cold_totals(db, str(user))
+        cold_ids = {doc["_id"] for doc in await cold_transactions(db, str(user))}
+
+        restored = await restore_transactions(db, str(user), {"_id": docs[1]["_id"]})
+        after_restore = await cold_totals(db, str(user))
+        hot_ids = {doc["_id"] async for doc in database.transactions.find({"u": user})}
+        return archived, totals, cold_ids, restored, after_restore, hot_ids, docs
+    finally:
+        await client.drop_database(database.name)
+        client.close()
+
+
+@pytest.mark.mongo
+def test_archive_cold_totals_and_restore():
+    archived, totals, cold_ids, restored, after_restore, hot_ids, docs = asyncio.run(archive_round_trip())
+
+    # The transaction deleted mid-run must not survive in its bucket.
+    assert archived == 2
+    assert cold_ids == {docs[0]["_id"], docs[1]["_id"]}
+    assert (totals["n"], totals["ti"], totals["te"]) == (2, 1000, 250)
+
+    assert restored == 1
+    assert (after_restore["n"], after_restore["ti"], after_restore["te"]) == (1, 1000, 0)
+    assert hot_ids == {docs[1]["_id"], docs[3]["_id"]}
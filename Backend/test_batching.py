@@ -0,0 +1,50 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from batching import InsertBatcher
+
+
+class RecordingCollection:
+    def __init__(self, fail_descriptions=()):
+        self.calls = []
+        self.fail_descriptions = set(fail_descriptions)
+
+    async def insert_many(self, docs, ordered):
+        self.calls.append(list(docs))
+        errors = [
+            {"index": index, "code": 11000, "errmsg": "duplicate key"}
+            for index, doc in enumerate(docs) if doc["d"] in self.fail_descriptions
+        ]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def test_concurrent_inserts_are_flushed_together():
+    collection = RecordingCollection()
+    batcher = InsertBatcher(collection, max_batch=10, max_delay=0.01)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.insert({"d": str(i)}) for i in range(25)))
+
+    ids = asyncio.run(scenario())
+
+    assert [len(call) for call in collection.calls] == [10, 10, 5]
+    assert ids == [doc["_id"] for call in collection.calls for doc in call]
+
+
+def test_each_caller_gets_its_own_error():
+    collection = RecordingCollection(fail_descriptions={"1"})
+    batcher = InsertBatcher(collection, max_batch=10, max_delay=0.01)
+
+    async def scenario():
+        return await asyncio.gather(
+            *(batcher.insert({"d": str(i)}) for i in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+
+    assert isinstance(results[1], DuplicateKeyError)
+    assert not isinstance(results[0], Exception)
+    assert not isinstance(results[2], Exception)
+    assert len(collection.calls) == 1
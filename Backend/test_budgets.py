@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+import budgets
+from budgets import period_bounds, period_key
+from models import BudgetPeriod
+from schema import encode_transaction
+
+
+def test_period_keys():
+    when = datetime(2024, 12, 31, 18, 30)
+
+    assert period_key(BudgetPeriod.MONTHLY, when) == "2024-12"
+    assert period_key(BudgetPeriod.YEARLY, when) == "2024"
+    assert period_key(BudgetPeriod.WEEKLY, when) == "2025-W01"
+
+
+def test_period_bounds_contain_their_key():
+    when = datetime(2024, 12, 31, 18, 30)
+
+    assert period_bounds(BudgetPeriod.MONTHLY, when) == (datetime(2024, 12, 1), datetime(2025, 1, 1))
+    assert period_bounds(BudgetPeriod.YEARLY, when) == (datetime(2024, 1, 1), datetime(2025, 1, 1))
+    start, end = period_bounds(BudgetPeriod.WEEKLY, when)
+    assert (start, end) == (datetime(2024, 12, 30), datetime(2025, 1, 6))
+    assert period_key(BudgetPeriod.WEEKLY, start) == period_key(BudgetPeriod.WEEKLY, when)
+
+
+def test_offset_dates_count_in_the_same_period_on_create_and_delete():
+    local = datetime(2024, 5, 31, 23, 0, tzinfo=timezone(timedelta(hours=-5)))
+    created = encode_transaction({"date": local})
+
+    # What Mongo hands back on update/delete: naive UTC.
+    read_back = local.astimezone(timezone.utc).replace(tzinfo=None)
+    assert created["dt"] == read_back
+    assert period_key(BudgetPeriod.MONTHLY, created["dt"]) == period_key(BudgetPeriod.MONTHLY, read_back) == "2024-06"
+
+
+class FakeBudgetCollection:
+    def __init__(self, budget):
+        self.budget = budget
+
+    def _matches(self, query):
+        for field, condition in query.items():
+            if field.startswith("spend."):
+                if (field[6:] in self.budget["spend"]) != condition["$exists"]:
+                    return False
+            elif self.budget.get(field) != condition:
+                return False
+        return True
+
+    def find(self, query, projection):
+        async def to_list(length):
+            return [{k: v for k, v in self.budget.items() if k != "spend"}]
+        return SimpleNamespace(to_list=to_list)
+
+    async def find_one(self, query, projection=None):
+        return dict(self.budget, spend=dict(self.budget["spend"])) if self._matches(query) else None
+
+    async def find_one_and_update(self, query, update, projection, return_document):
+        if not self._matches(query):
+            return None
+        for field, delta in update["$inc"].items():
+            key = field[6:]
+            self.budget["spend"][key] = self.budget["spend"].get(key, 0) + delta
+        return await self.find_one({})
+
+    async def update_one(self, query, update):
+        if not self._matches(query):
+            return SimpleNamespace(modified_count=0)
+        for field, value in update["$set"].items():
+            self.budget["spend"][field[6:]] = value
+        return SimpleNamespace(modified_count=1)
+
+
+def spend_fixture(monkeypatch, spend, stored_cents):
+    budget = {
+        "_id": ObjectId(), "user_id": "u1", "category": "Food", "category_code": 3,
+        "period": BudgetPeriod.MONTHLY, "limit_amount": 100.0, "spend": spend
+    }
+    db = SimpleNamespace(
+        budget_collection=FakeBudgetCollection(budget),
+        settings=SimpleNamespace(record_budget_events=False)
+    )
+
+    async def period_spend(db, user_id, category_code, start, end):
+        return stored_cents
+
+    monkeypatch.setattr(budgets, "period_spend", period_spend)
+    return db, budget
+
+
+def test_back_dated_write_seeds_its_period_instead_of_incrementing(monkeypatch):
+    # The stored transactions for March already include the 4000 just written.
+    db, budget = spend_fixture(monkeypatch, {"2024-05": 1000}, stored_cents=12000)
+
+    alerts = asyncio.run(budgets.apply_spend_changes(db, "u1", [(3, datetime(2024, 3, 9), 4000)]))
+
+    assert budget["spend"] == {"2024-05": 1000, "2024-03": 12000}
+    assert [alert["period_key"] for alert in alerts] == ["2024-03"]
+
+
+def test_seeded_period_is_incremented(monkeypatch):
+    db, budget = spend_fixture(monkeypatch, {"2024-05": 9000}, stored_cents=0)
+
+    alerts = asyncio.run(budgets.apply_spend_changes(db, "u1", [(3, datetime(2024, 5, 2), 500)]))
+
+    assert budget["spend"] == {"2024-05": 9500}
+    assert alerts == []
+
+
+def test_reading_a_new_period_seeds_it(monkeypatch):
+    db, budget = spend_fixture(monkeypatch, {}, stored_cents=2500)
+
+    current = asyncio.run(budgets.with_current_spend(db, dict(budget), datetime(2024, 6, 1)))
+
+    assert current["spend"] == {"2024-06": 2500}
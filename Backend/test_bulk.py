@@ -0,0 +1,244 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from bson.int64 import Int64
+from fastapi import HTTPException
+
+import ledger
+import main
+from models import BulkDeleteRequest, BulkUpdateRequest, TransactionFilter, TransactionUpdate
+from schema import CategoryCodes
+
+
+FOOD, TRAVEL = 1, 2
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        value = doc.get(key)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$gte" in condition and not value >= condition["$gte"]:
+                return False
+            if "$lte" in condition and not value <= condition["$lte"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeTransactionCollection:
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+
+    def _find(self, query):
+        return next((doc for doc in self.docs.values() if matches(doc, query)), None)
+
+    async def find_one_and_update(self, query, update):
+        doc = self._find(query)
+        if doc is None:
+            return None
+        before = dict(doc)
+        doc.update(update.get("$set", {}))
+        for key in update.get("$unset", {}):
+            doc.pop(key, None)
+        return before
+
+    async def find_one_and_delete(self, query):
+        doc = self._find(query)
+        if doc is not None:
+            del self.docs[doc["_id"]]
+        return doc
+
+
+class FakeGoalCollection:
+    async def find_one(self, query, projection):
+        return {"_id": query["_id"]}
+
+
+@pytest.fixture
+def codes(monkeypatch):
+    codes = CategoryCodes()
+    codes._remember(FOOD, "Food")
+    codes._remember(TRAVEL, "Travel")
+    monkeypatch.setattr(main, "category_codes", codes)
+    monkeypatch.setattr(ledger, "category_codes", codes)
+    return codes
+
+
+@pytest.fixture
+def derived(monkeypatch):
+    """Capture what ``record_transaction_changes`` hands to each derived store."""
+    captured = {}
+
+    async def record_counts(db, user_id, deltas):
+        captured["categories"] = deltas
+
+    async def apply_goal_deltas(db, user_id, deltas):
+        captured["goals"] = dict(deltas)
+
+    async def apply_spend_changes(db, user_id, entries):
+        captured["spend"] = sorted(entries)
+        return []
+
+    monkeypatch.setattr(ledger.category_index, "record_counts", record_counts)
+    monkeypatch.setattr(ledger, "apply_goal_deltas", apply_goal_deltas)
+    monkeypatch.setattr(ledger, "apply_spend_changes", apply_spend_changes)
+    return captured
+
+
+def run_bulk(monkeypatch, endpoint, request, matched, concurrent=lambda docs: None):
+    """Run ``endpoint`` over the ``matched`` snapshot; ``concurrent`` changes the
+    stored documents after the snapshot was read, like a racing single write."""
+    db = SimpleNamespace(transaction_collection=FakeTransactionCollection(matched), goal_collection=FakeGoalCollection())
+
+    async def get_user_database(user_id):
+        return db
+
+    async def find_matching_transactions(db, user_id, query):
+        concurrent(db.transaction_collection.docs)
+        return matched
+
+    monkeypatch.setattr(main, "get_user_database", get_user_database)
+    monkeypatch.setattr(main, "find_matching_transactions", find_matching_transactions)
+    monkeypatch.setattr(main, "owner_filter", lambda user_id: {})
+    return asyncio.run(endpoint(request, str(ObjectId()))), db
+
+
+def stored(category, amount, goal=None, type_code=1):
+    doc = {"_id": ObjectId(), "a": Int64(amount), "t": type_code, "c": category, "dt": datetime(2024, 3, 5)}
+    if goal is not None:
+        doc["g"] = goal
+    return doc
+
+
+def test_filter_translation(codes):
+    ids = [str(ObjectId()), str(ObjectId())]
+    start, end = datetime(2024, 1, 1), datetime(2024, 1, 31)
+    criteria = TransactionFilter(ids=ids, category="Food", type="expense", start_date=start, end_date=end)
+
+    query = asyncio.run(main.build_transaction_query(None, criteria))
+
+    assert query == {
+        "_id": {"$in": [ObjectId(transaction_id) for transaction_id in ids]},
+        "c": FOOD,
+        "t": 1,
+        "dt": {"$gte": start, "$lte": end},
+    }
+    assert asyncio.run(main.build_transaction_query(None, TransactionFilter(start_date=start))) == {
+        "dt": {"$gte": start}
+    }
+
+
+def test_unknown_category_matches_nothing(codes):
+    async def find_one(query):
+        return None
+
+    db = SimpleNamespace(category_code_collection=SimpleNamespace(find_one=find_one))
+    assert asyncio.run(main.build_transaction_query(db, TransactionFilter(category="Rent"))) is None
+
+
+def test_empty_and_malformed_filters_are_rejected(codes):
+    with pytest.raises(HTTPException) as empty:
+        asyncio.run(main.build_transaction_query(None, TransactionFilter()))
+    assert empty.value.status_code == 400
+
+    with pytest.raises(HTTPException) as malformed:
+        asyncio.run(main.build_transaction_query(None, TransactionFilter(ids=["not-an-id"])))
+    assert malformed.value.status_code == 400
+
+
+def test_bulk_category_change_moves_counts_and_spend(monkeypatch, codes, derived):
+    matched = [stored(FOOD, 1200), stored(FOOD, 800), stored(TRAVEL, 500)]
+    request = BulkUpdateRequest(
+        filter=TransactionFilter(ids=[str(doc["_id"]) for doc in matched]),
+        update=TransactionUpdate(category="Travel")
+    )
+
+    response, db = run_bulk(monkeypatch, main.bulk_update_transactions, request, matched)
+
+    assert (response.matched_count, response.modified_count) == (3, 2)
+    assert {doc["c"] for doc in db.transaction_collection.docs.values()} == {TRAVEL}
+    assert derived["categories"] == {"Food": -2, "Travel": 2}
+    assert derived["goals"] == {}
+    when = datetime(2024, 3, 5)
+    assert derived["spend"] == sorted([
+        (FOOD, when, -1200), (FOOD, when, -800), (TRAVEL, when, 1200), (TRAVEL, when, 800),
+    ])
+
+
+def test_bulk_goal_move_shifts_progress(monkeypatch, codes, derived):
+    old_goal, new_goal = ObjectId(), ObjectId()
+    matched = [stored(FOOD, 1000, goal=old_goal), stored(FOOD, 250, goal=old_goal), stored(FOOD, 400)]
+    request = BulkUpdateRequest(
+        filter=TransactionFilter(category="Food"),
+        update=TransactionUpdate(goal_id=str(new_goal))
+    )
+
+    response, db = run_bulk(monkeypatch, main.bulk_update_transactions, request, matched)
+
+    assert response.modified_count == 3
+    assert {doc["g"] for doc in db.transaction_collection.docs.values()} == {new_goal}
+    assert derived["goals"] == {old_goal: -1250, new_goal: 1650}
+    assert derived["categories"] == {"Food": 0}
+
+
+def test_bulk_update_records_the_write_not_the_snapshot(monkeypatch, codes, derived):
+    goal = ObjectId()
+    deleted, edited, untouched = stored(FOOD, 100, goal=goal), stored(FOOD, 200, goal=goal), stored(FOOD, 300, goal=goal)
+    matched = [deleted, edited, untouched]
+
+    def racing_writes(docs):
+        # A single DELETE and a single PUT land between the read and the write.
+        del docs[deleted["_id"]]
+        docs[edited["_id"]]["a"] = Int64(250)
+
+    request = BulkUpdateRequest(filter=TransactionFilter(category="Food"), update=TransactionUpdate(goal_id=None))
+    response, db = run_bulk(monkeypatch, main.bulk_update_transactions, request, matched, racing_writes)
+
+    assert (response.matched_count, response.modified_count) == (3, 2)
+    # The deleted transaction was already subtracted by its own route; the
+    # edited one leaves the goal with its new amount.
+    assert derived["goals"] == {goal: -550}
+
+
+def test_bulk_delete_reverses_every_match(monkeypatch, codes, derived):
+    goal = ObjectId()
+    matched = [stored(FOOD, 300, goal=goal), stored(TRAVEL, 700, type_code=0)]
+    request = BulkDeleteRequest(filter=TransactionFilter(start_date=datetime(2024, 3, 1)))
+
+    response, db = run_bulk(monkeypatch, main.bulk_delete_transactions, request, matched)
+
+    assert (response.matched_count, response.deleted_count) == (2, 2)
+    assert derived["categories"] == {"Food": -1, "Travel": -1}
+    assert derived["goals"] == {goal: -300}
+    assert derived["spend"] == [(FOOD, datetime(2024, 3, 5), -300)]
+
+
+def test_bulk_delete_skips_documents_deleted_or_moved_concurrently(monkeypatch, codes, derived):
+    goal = ObjectId()
+    gone, recategorised, kept = stored(FOOD, 100, goal=goal), stored(FOOD, 200, goal=goal), stored(FOOD, 400, goal=goal)
+
+    def racing_writes(docs):
+        del docs[gone["_id"]]
+        docs[recategorised["_id"]]["c"] = TRAVEL
+
+    request = BulkDeleteRequest(filter=TransactionFilter(category="Food"))
+    response, db = run_bulk(monkeypatch, main.bulk_delete_transactions, request, [gone, recategorised, kept], racing_writes)
+
+    assert (response.matched_count, response.deleted_count) == (3, 1)
+    assert list(db.transaction_collection.docs) == [recategorised["_id"]]
+    assert derived["categories"] == {"Food": -1}
+    assert derived["goals"] == {goal: -400}
+
+
+def test_bulk_update_without_fields_is_rejected(monkeypatch, codes, derived):
+    request = BulkUpdateRequest(filter=TransactionFilter(category="Food"), update=TransactionUpdate())
+
+    with pytest.raises(HTTPException) as rejected:
+        run_bulk(monkeypatch, main.bulk_update_transactions, request, [])
+    assert rejected.value.status_code == 400
@@ -0,0 +1,45 @@
+import asyncio
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+from categories import CategoryIndex, _UserCategories
+
+
+def test_prefix_search_orders_by_usage():
+    index = _UserCategories({"Food": 3, "Fuel": 5, "Freelance": 1, "Rent": 4})
+
+    assert index.search("f", 10) == [("Fuel", 5), ("Food", 3), ("Freelance", 1)]
+    assert index.search("FO", 10) == [("Food", 3)]
+    assert index.search("", 2) == [("Fuel", 5), ("Rent", 4)]
+    assert index.search("x", 10) == []
+
+
+def test_adjust_inserts_and_hides_unused():
+    index = _UserCategories({"Food": 1})
+    index.adjust("Fitness", 1)
+    index.adjust("Food", -1)
+
+    assert index.search("f", 10) == [("Fitness", 1)]
+
+
+class FakeUserCategoryCollection:
+    async def _iterate(self, user_id):
+        yield {"n": f"Category {user_id}", "cnt": 1}
+
+    def find(self, query):
+        return self._iterate(str(query["u"]))
+
+
+def test_index_evicts_least_recently_used_user():
+    db = SimpleNamespace(user_category_collection=FakeUserCategoryCollection())
+    index = CategoryIndex(max_users=2)
+    first, second, third = (str(ObjectId()) for _ in range(3))
+
+    async def touch(*user_ids):
+        for user_id in user_ids:
+            await index.search(db, user_id, "", 10)
+
+    asyncio.run(touch(first, second, first, third))
+
+    assert list(index._users) == [first, third]
@@ -0,0 +1,44 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+from main import app
+
+
+pytestmark = pytest.mark.mongo
+
+CONCURRENT_CONTRIBUTIONS = 200
+
+
+async def stress_contributions():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        credentials = {"email": f"{uuid.uuid4().hex}@example.com", "password": "secret123"}
+        await client.post("/auth/register", json={**credentials, "name": "Stress"})
+        token = (await client.post("/auth/login", json=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        goal = (await client.post(
+            "/goals",
+            json={"name": "Bike", "target_amount": 1000, "category": "purchase"},
+            headers=headers
+        )).json()
+
+        responses = await asyncio.gather(*(
+            client.post(f"/goals/{goal['_id']}/contributions", json={"amount": 1.5}, headers=headers)
+            for _ in range(CONCURRENT_CONTRIBUTIONS)
+        ))
+        assert all(response.status_code == 201 for response in responses)
+
+        final = (await client.get(f"/goals/{goal['_id']}", headers=headers)).json()
+        history = (await client.get(f"/goals/{goal['_id']}/contributions", headers=headers)).json()
+        return final, history
+
+
+def test_concurrent_contributions_are_not_lost():
+    final, history = asyncio.run(stress_contributions())
+
+    assert final["current_amount"] == pytest.approx(1.5 * CONCURRENT_CONTRIBUTIONS)
+    assert len(history) == CONCURRENT_CONTRIBUTIONS
@@ -0,0 +1,45 @@
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+import goals
+
+
+class FakeGoalCollection:
+    def __init__(self, counters):
+        self.counters = counters
+        self.writes = []
+
+    async def _iterate(self):
+        for goal_oid, counter in self.counters.items():
+            yield {"_id": goal_oid, "tagged_cents": counter}
+
+    def find(self, query, projection):
+        return self._iterate()
+
+    async def bulk_write(self, operations, ordered):
+        self.writes.extend(operations)
+        return SimpleNamespace(modified_count=len(operations))
+
+
+def test_only_drift_stable_across_passes_is_corrected(monkeypatch):
+    drifted, in_flight, healthy = ObjectId(), ObjectId(), ObjectId()
+    collection = FakeGoalCollection({drifted: 500, in_flight: 100, healthy: 300})
+    passes = iter([
+        Counter({drifted: 700, in_flight: 100, healthy: 300}),
+        # A tagged transaction landed between the passes; its $inc hasn't yet.
+        Counter({drifted: 700, in_flight: 150, healthy: 300}),
+    ])
+
+    async def fake_totals(db):
+        return next(passes)
+
+    monkeypatch.setattr(goals, "tagged_totals", fake_totals)
+    corrected = asyncio.run(goals.reconcile_goal_progress(SimpleNamespace(goal_collection=collection), 0))
+
+    assert corrected == 1
+    [operation] = collection.writes
+    assert operation._filter == {"_id": drifted, "tagged_cents": 500}
+    assert operation._doc["$inc"]["tagged_cents"] == 200
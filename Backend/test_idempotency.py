@@ -0,0 +1,158 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+import idempotency
+from idempotency import IdempotencyStore, _fingerprint
+from models import TransactionCreate, TransactionResponse
+
+
+BODY = {"description": "Coffee", "amount": 3.5, "type": "expense", "category": "Food"}
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+
+    async def insert_one(self, doc):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate key")
+        self.docs[doc["_id"]] = dict(doc)
+
+    async def find_one(self, query):
+        return self.docs.get(query["_id"])
+
+    async def update_one(self, query, update):
+        self.docs[query["_id"]].update(update["$set"])
+
+    async def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+    async def find_one_and_update(self, query, update):
+        doc = self.docs.get(query["_id"])
+        if doc is None or any(doc.get(field) != value for field, value in query.items()):
+            return None
+        before = dict(doc)
+        doc.update(update["$set"])
+        return before
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.idempotency_collection = FakeCollection()
+
+
+def make_handler(calls, delay=0, fail=False):
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("insert failed")
+        return {**BODY, "_id": f"id{len(calls)}", "user_id": "u1", "date": "2024-01-01T00:00:00"}
+    return handler
+
+
+def run(store, db, payload, handler, key="k1"):
+    return store.run(db, "u1", key, "transactions", payload, TransactionResponse, 201, handler)
+
+
+def test_fingerprint_ignores_default_factories():
+    first = _fingerprint(TransactionCreate(**BODY))
+    time.sleep(0.01)
+    assert _fingerprint(TransactionCreate(**BODY)) == first
+    assert _fingerprint(TransactionCreate(**{**BODY, "amount": 4})) != first
+
+
+def test_retry_replays_stored_response():
+    store, db, calls = IdempotencyStore(), FakeDatabase(), []
+
+    async def scenario():
+        first = await run(store, db, TransactionCreate(**BODY), make_handler(calls))
+        second = await run(store, db, TransactionCreate(**BODY), make_handler(calls))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert first.status_code == second.status_code == 201
+    assert first.body == second.body
+
+
+def test_concurrent_duplicates_share_one_execution():
+    store, db, calls = IdempotencyStore(), FakeDatabase(), []
+
+    async def scenario():
+        return await asyncio.gather(*(
+            run(store, db, TransactionCreate(**BODY), make_handler(calls, delay=0.01))
+            for _ in range(5)
+        ))
+
+    responses = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert len({response.body for response in responses}) == 1
+
+
+def test_reused_key_with_different_body_is_rejected():
+    store, db, calls = IdempotencyStore(), FakeDatabase(), []
+
+    async def scenario():
+        await run(store, db, TransactionCreate(**BODY), make_handler(calls))
+        await run(store, db, TransactionCreate(**{**BODY, "amount": 9}), make_handler(calls))
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(scenario())
+
+    assert raised.value.status_code == 422
+    assert len(calls) == 1
+
+
+def test_failed_request_releases_its_key():
+    store, db, calls = IdempotencyStore(), FakeDatabase(), []
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await run(store, db, TransactionCreate(**BODY), make_handler(calls, fail=True))
+        assert db.idempotency_collection.docs == {}
+        return await run(store, db, TransactionCreate(**BODY), make_handler(calls))
+
+    response = asyncio.run(scenario())
+
+    assert response.status_code == 201
+    assert len(calls) == 2
+
+
+def pending_record(db, age_seconds):
+    db.idempotency_collection.docs["u1:transactions:k1"] = {
+        "_id": "u1:transactions:k1",
+        "fingerprint": _fingerprint(TransactionCreate(**BODY)),
+        "pending": True,
+        "created_at": datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    }
+
+
+def test_retry_takes_over_a_pending_record_whose_worker_died():
+    store, db, calls = IdempotencyStore(), FakeDatabase(), []
+    pending_record(db, idempotency.PENDING_LEASE_SECONDS + 1)
+
+    response = asyncio.run(run(store, db, TransactionCreate(**BODY), make_handler(calls)))
+
+    assert response.status_code == 201
+    assert len(calls) == 1
+    assert db.idempotency_collection.docs["u1:transactions:k1"]["pending"] is False
+
+
+def test_retry_waits_while_the_lease_is_held(monkeypatch):
+    monkeypatch.setattr(idempotency, "PENDING_TIMEOUT_SECONDS", 0.1)
+    store, db, calls = IdempotencyStore(), FakeDatabase(), []
+    pending_record(db, 0)
+
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(run(store, db, TransactionCreate(**BODY), make_handler(calls)))
+
+    assert raised.value.status_code == 409
+    assert calls == []
@@ -0,0 +1,117 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import refresh_tokens as tokens
+from database import get_database
+from main import app
+
+
+class FakeTokenCollection:
+    def __init__(self):
+        self.docs = {}
+
+    async def insert_one(self, doc):
+        self.docs[doc["_id"]] = dict(doc)
+
+    async def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=None):
+        doc = self.docs.get(query["_id"])
+        if doc is None or "used_at" in doc or doc["expires_at"] <= query["expires_at"]["$gt"]:
+            return None
+        before = dict(doc)
+        doc.update(update["$set"])
+        return before
+
+    async def delete_many(self, query):
+        self.docs = {key: doc for key, doc in self.docs.items() if doc["family"] != query["family"]}
+
+
+def fake_db():
+    return SimpleNamespace(
+        refresh_token_collection=FakeTokenCollection(),
+        settings=SimpleNamespace(refresh_token_days=30)
+    )
+
+
+def test_concurrent_refreshes_within_grace_get_the_same_token():
+    db, store = fake_db(), tokens.RefreshTokenStore()
+
+    async def scenario():
+        first = await store.issue(db, "u1")
+        return await store.rotate(db, first), await store.rotate(db, first)
+
+    (user_a, token_a), (user_b, token_b) = asyncio.run(scenario())
+
+    assert user_a == user_b == "u1"
+    assert token_a == token_b
+    assert len(db.refresh_token_collection.docs) == 2
+
+
+def test_reuse_after_grace_revokes_the_family():
+    db, store = fake_db(), tokens.RefreshTokenStore()
+
+    async def scenario():
+        first = await store.issue(db, "u1")
+        _, second = await store.rotate(db, first)
+        spent = db.refresh_token_collection.docs[tokens._hash(first)]
+        spent["used_at"] -= timedelta(seconds=tokens.REUSE_GRACE_SECONDS + 1)
+
+        with pytest.raises(HTTPException):
+            await store.rotate(db, first)
+        with pytest.raises(HTTPException):
+            await store.rotate(db, second)
+
+    asyncio.run(scenario())
+    assert db.refresh_token_collection.docs == {}
+
+
+async def refresh_flow():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        credentials = {"email": f"{uuid.uuid4().hex}@example.com", "password": "secret123"}
+        await client.post("/auth/register", json={**credentials, "name": "Refresh"})
+        first = (await client.post("/auth/login", json=credentials)).json()
+
+        rotated = await client.post("/auth/refresh", json={"refresh_token": first["refresh_token"]})
+        assert rotated.status_code == 200
+        second = rotated.json()
+        me = await client.get("/auth/me", headers={"Authorization": f"Bearer {second['access_token']}"})
+        assert me.status_code == 200
+
+        # A replay right away (another tab) gets the same pair; later it revokes the session.
+        replay = await client.post("/auth/refresh", json={"refresh_token": first["refresh_token"]})
+        assert replay.json()["refresh_token"] == second["refresh_token"]
+        await get_database().refresh_token_collection.update_one(
+            {"_id": tokens._hash(first["refresh_token"])},
+            {"$set": {"used_at": datetime.now(timezone.utc) - timedelta(minutes=5)}}
+        )
+        replay = await client.post("/auth/refresh", json={"refresh_token": first["refresh_token"]})
+        assert replay.status_code == 401
+        revoked = await client.post("/auth/refresh", json={"refresh_token": second["refresh_token"]})
+        assert revoked.status_code == 401
+
+        other = (await client.post("/auth/login", json=credentials)).json()
+        current = (await client.post("/auth/login", json=credentials)).json()
+        changed = await client.put(
+            "/auth/password",
+            json={"current_password": "secret123", "new_password": "secret456"},
+            headers={"Authorization": f"Bearer {current['access_token']}"}
+        )
+        assert changed.status_code == 200
+        signed_out = await client.post("/auth/refresh", json={"refresh_token": other["refresh_token"]})
+        assert signed_out.status_code == 401
+        kept = await client.post("/auth/refresh", json={"refresh_token": changed.json()["refresh_token"]})
+        assert kept.status_code == 200
+
+
+@pytest.mark.mongo
+def test_refresh_tokens_rotate_and_detect_reuse():
+    asyncio.run(refresh_flow())
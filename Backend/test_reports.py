@@ -0,0 +1,95 @@
+import asyncio
+import csv
+from datetime import datetime
+from types import SimpleNamespace
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from models import ReportCreate, ReportFormat, ReportPeriod
+from reports import ReportJobs, StatementTotals, period_range, report_key, write_csv, write_pdf
+
+
+NAMES = {1: "Groceries", 2: "Rent", 3: "Salary"}
+DOCS = [
+    {"dt": datetime(2024, 12, 3), "a": 4250, "t": 1, "c": 1, "d": "Market"},
+    {"dt": datetime(2024, 12, 5), "a": 120000, "t": 1, "c": 2, "d": "December rent"},
+    {"dt": datetime(2024, 12, 28), "a": 300000, "t": 0, "c": 3, "d": "Payroll"},
+]
+
+
+def test_period_range_and_key():
+    assert period_range(ReportPeriod.MONTHLY, 2024, 12) == (datetime(2024, 12, 1), datetime(2025, 1, 1))
+    assert period_range(ReportPeriod.ANNUAL, 2024, None) == (datetime(2024, 1, 1), datetime(2025, 1, 1))
+
+    monthly = ReportCreate(period=ReportPeriod.MONTHLY, year=2024, month=5, format=ReportFormat.PDF)
+    assert report_key(monthly) == "monthly:2024-05:pdf"
+    assert report_key(ReportCreate(period=ReportPeriod.ANNUAL, year=2024)) == "annual:2024:csv"
+
+
+def test_csv_statement_streams_rows_then_summary(tmp_path):
+    totals = StatementTotals()
+    path = tmp_path / "statement.csv"
+    write_csv(str(path), (totals.add(doc) for doc in DOCS), totals, NAMES, "Statement for December 2024")
+
+    with open(path, newline="") as handle:
+        lines = list(csv.reader(handle))
+    assert lines[2] == ["2024-12-03", "expense", "Groceries", "Market", "42.50"]
+    assert ["Rent", "1200.00", "96.6%"] in lines
+    assert lines[-1] == ["total", "3000.00", "1242.50"]
+    assert totals.count == 3
+
+
+def test_pdf_statement(tmp_path):
+    totals = StatementTotals()
+    path = tmp_path / "statement.pdf"
+    write_pdf(str(path), (totals.add(doc) for doc in DOCS), totals, NAMES, "Statement for December 2024")
+
+    assert path.read_bytes().startswith(b"%PDF")
+
+
+class FakeJobCollection:
+    """Enforces the two unique partial indexes over active jobs."""
+
+    def __init__(self):
+        self.jobs = []
+
+    async def find_one(self, query):
+        return next((job for job in self.jobs if all(job.get(k) == v for k, v in query.items())), None)
+
+    async def insert_one(self, job):
+        await asyncio.sleep(0)
+        for field in ("key", "slot"):
+            if any(other.get("active") and other["user_id"] == job["user_id"] and other[field] == job[field]
+                   for other in self.jobs):
+                raise DuplicateKeyError("duplicate", details={"keyPattern": {"user_id": 1, field: 1}})
+        job["_id"] = ObjectId()
+        self.jobs.append(dict(job))
+        return SimpleNamespace(inserted_id=job["_id"])
+
+
+def test_concurrent_submits_respect_the_active_cap(monkeypatch):
+    async def no_render(self, db, job):
+        pass
+
+    monkeypatch.setattr(ReportJobs, "_run", no_render)
+    db = SimpleNamespace(
+        report_job_collection=FakeJobCollection(),
+        settings=SimpleNamespace(report_max_active_per_user=2, report_ttl_hours=24)
+    )
+    jobs = ReportJobs()
+
+    async def submit_all():
+        reports = [ReportCreate(period=ReportPeriod.MONTHLY, year=2024, month=month) for month in (1, 2, 3, 1)]
+        return await asyncio.gather(
+            *(jobs.submit(db, "user", report) for report in reports), return_exceptions=True
+        )
+
+    results = asyncio.run(submit_all())
+
+    stored = db.report_job_collection.jobs
+    assert sorted(job["slot"] for job in stored) == [0, 1]
+    assert [r.status_code for r in results if isinstance(r, HTTPException)] == [429]
+    # The repeated January request shares the January job instead of taking a slot.
+    assert results[3]["key"] == "monthly:2024-01:csv"
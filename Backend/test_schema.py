@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from bson import ObjectId
+from bson.int64 import Int64
+
+import schema
+from schema import (
+    LegacyTransactions,
+    apply_patch,
+    decode_transaction,
+    encode_transaction,
+    from_cents,
+    to_cents,
+    transaction_projection,
+    update_operations
+)
+
+
+def test_cents_round_trip():
+    assert to_cents(0.1) + to_cents(0.2) == to_cents(0.3)
+    assert to_cents(19.99) == 1999
+    assert to_cents(2.675) == 268
+    assert from_cents(1999) == 19.99
+
+
+def test_transaction_round_trip():
+    user_id = str(ObjectId())
+    date = datetime(2024, 1, 15, tzinfo=timezone.utc)
+    stored = encode_transaction(
+        {
+            "description": "Salary",
+            "amount": 5000.25,
+            "type": "income",
+            "category": "Job",
+            "date": date,
+            "user_id": user_id,
+        },
+        category_code=7
+    )
+
+    assert stored == {"d": "Salary", "a": Int64(500025), "t": 0, "c": 7, "dt": date.replace(tzinfo=None), "u": ObjectId(user_id)}
+
+    stored["_id"] = ObjectId()
+    decoded = decode_transaction(stored, "Job")
+    assert decoded["amount"] == 5000.25
+    assert decoded["type"] == "income"
+    assert decoded["user_id"] == user_id
+
+
+def test_partial_update_encoding():
+    assert encode_transaction({"amount": 12.5, "type": "expense"}) == {"a": 1250, "t": 1}
+
+
+def test_clearing_goal_unsets_key():
+    goal_id = ObjectId()
+    doc = {"_id": ObjectId(), "a": 100, "g": goal_id}
+    patch = encode_transaction({"goal_id": None, "amount": 2})
+
+    assert update_operations(patch) == {"$set": {"a": 200}, "$unset": {"g": ""}}
+    assert apply_patch(doc, patch) == {"_id": doc["_id"], "a": 200}
+    assert apply_patch(doc, encode_transaction({"goal_id": str(goal_id)}))["g"] == goal_id
+
+
+def test_sparse_decode_reads_only_projected_keys():
+    fields = ("amount", "date")
+    projection = transaction_projection(fields)
+    assert projection == {"dt": 1, "a": 1}
+
+    stored = {"_id": ObjectId(), "a": Int64(1250), "dt": datetime(2024, 1, 15)}
+    assert decode_transaction(stored, None, fields) == {
+        "_id": str(stored["_id"]),
+        "amount": 12.5,
+        "date": datetime(2024, 1, 15),
+    }
+
+
+class FakeTransactionCollection:
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.finds = 0
+
+    def find(self, query):
+        self.finds += 1
+        matched = [dict(doc) for doc in self.docs.values() if doc.get("user_id") == query["user_id"]]
+        return SimpleNamespace(to_list=lambda length: asyncio.sleep(0, matched))
+
+    async def bulk_write(self, operations, ordered):
+        modified = 0
+        for operation in operations:
+            query, replacement = operation._filter, operation._doc
+            if "user_id" in self.docs[query["_id"]]:
+                self.docs[query["_id"]] = {"_id": query["_id"], **replacement}
+                modified += 1
+        return SimpleNamespace(modified_count=modified)
+
+
+def test_legacy_transactions_are_converted_once_per_user(monkeypatch):
+    async def encode(db, name):
+        return {"Food": 1, "Job": 2}[name]
+
+    monkeypatch.setattr(schema.category_codes, "encode", encode)
+    user_id, other_id = str(ObjectId()), str(ObjectId())
+    legacy = {
+        "_id": ObjectId(), "user_id": user_id, "description": "Lunch", "amount": 12.5,
+        "type": "expense", "category": "Food", "date": datetime(2024, 1, 15)
+    }
+    untouched = {**legacy, "_id": ObjectId(), "user_id": other_id, "category": "Job"}
+    collection = FakeTransactionCollection([legacy, untouched])
+    db = SimpleNamespace(transaction_collection=collection)
+    converter = LegacyTransactions()
+
+    asyncio.run(converter.convert_user(db, user_id))
+    asyncio.run(converter.convert_user(db, user_id))
+
+    assert collection.finds == 1
+    assert collection.docs[legacy["_id"]] == {
+        "_id": legacy["_id"], "u": ObjectId(user_id), "d": "Lunch", "a": Int64(1250),
+        "t": 1, "c": 1, "dt": datetime(2024, 1, 15)
+    }
+    assert collection.docs[untouched["_id"]] == untouched
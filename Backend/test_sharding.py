@@ -0,0 +1,106 @@
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+import pytest
+
+import rebalance
+from database import HashRing, Settings, shard_url_map
+
+
+def test_ring_is_deterministic_and_balanced():
+    ring = HashRing(["shard0", "shard1", "shard2"])
+    user_ids = [str(ObjectId()) for _ in range(3000)]
+
+    assert [ring.node_for(u) for u in user_ids] == [HashRing(["shard0", "shard1", "shard2"]).node_for(u) for u in user_ids]
+
+    counts = Counter(ring.node_for(u) for u in user_ids)
+    assert set(counts) == {"shard0", "shard1", "shard2"}
+    assert min(counts.values()) > 700
+
+
+def test_adding_a_shard_only_moves_users_onto_it():
+    before = HashRing(["shard0", "shard1", "shard2"])
+    after = HashRing(["shard0", "shard1", "shard2", "shard3"])
+    user_ids = [str(ObjectId()) for _ in range(3000)]
+
+    moved = [u for u in user_ids if before.node_for(u) != after.node_for(u)]
+
+    assert all(after.node_for(u) == "shard3" for u in moved)
+    assert 450 < len(moved) < 1050
+
+
+def test_directory_instance_is_always_shard0():
+    settings = Settings(
+        mongodb_url="mongodb://localhost:27017",
+        shard_urls={"shard2": "mongodb://localhost:27019", "shard1": "mongodb://localhost:27018"}
+    )
+
+    assert shard_url_map(settings) == {
+        "shard0": "mongodb://localhost:27017",
+        "shard1": "mongodb://localhost:27018",
+        "shard2": "mongodb://localhost:27019",
+    }
+    assert shard_url_map(Settings(mongodb_url="mongodb://db:27017", shard_urls={})) == {"shard0": "mongodb://db:27017"}
+
+
+def test_shard_names_cannot_alias_an_instance():
+    with pytest.raises(ValueError):
+        shard_url_map(Settings(mongodb_url="mongodb://a", shard_urls={"shard0": "mongodb://b"}))
+    with pytest.raises(ValueError):
+        shard_url_map(Settings(mongodb_url="mongodb://a", shard_urls={"shard1": "mongodb://a"}))
+    with pytest.raises(ValueError):
+        shard_url_map(Settings(mongodb_url="mongodb://a", shard_urls={"shard1": "mongodb://b", "shard2": "mongodb://b"}))
+
+
+def test_move_flips_the_directory_only_after_the_source_goes_quiet(monkeypatch):
+    events = []
+    late_writes = iter([3, 1, 0])
+
+    class Directory:
+        async def find_one(self, query):
+            return {"_id": query["_id"], "shard": "shard0"}
+
+        async def update_one(self, query, update):
+            events.append(("directory", update))
+
+    class Collection:
+        async def delete_many(self, owner):
+            events.append("delete")
+
+    async def copy_user(source, target, user_id, prune):
+        events.append(("copy", prune))
+        return next(late_writes) if prune else 10
+
+    async def wait_for_reports(source, user_id):
+        events.append("reports")
+
+    async def sleep(seconds):
+        events.append("sleep")
+
+    async def convert_user(db, user_id):
+        events.append("convert")
+
+    monkeypatch.setattr(rebalance.legacy_transactions, "convert_user", convert_user)
+    monkeypatch.setattr(rebalance, "copy_user", copy_user)
+    monkeypatch.setattr(rebalance, "wait_for_reports", wait_for_reports)
+    monkeypatch.setattr(rebalance, "user_scoped_collections", lambda shard, user_id: [(Collection(), {})])
+    monkeypatch.setattr(rebalance.asyncio, "sleep", sleep)
+    db = SimpleNamespace(
+        directory_collection=Directory(),
+        shards={"shard0": object(), "shard1": object()},
+        settings=SimpleNamespace(shard_cache_seconds=5)
+    )
+
+    asyncio.run(rebalance.move_user(db, str(ObjectId()), "shard1"))
+
+    assert events == [
+        "convert", ("copy", False),
+        ("directory", {"$set": {"moving": True}}),
+        "sleep", "reports",
+        ("copy", True), "sleep", ("copy", True), "sleep", ("copy", True),
+        ("directory", {"$set": {"shard": "shard1"}, "$unset": {"moving": ""}}),
+        "delete",
+    ]
@@ -14,6 +14,9 @@ import Goals from './components/Goals';
 import './App.css';
 import './components/recurring-goals.css';
 
+// The list, filters and charts only read these; `_id` always comes back.
+const LIST_FIELDS = 'description,amount,type,category,date';
+
 function App() {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [user, setUser] = useState(null);
@@ -82,7 +85,7 @@ function App() {
 
   const fetchTransactions = async () => {
     try {
-      const response = await transactionAPI.getAll();
+      const response = await transactionAPI.getAll(LIST_FIELDS);
       setTransactions(response.data);
       setError(null);
     } catch (err) {
@@ -116,7 +119,7 @@ function App() {
         console.log('Login after registration successful');
       }
 
-      setAuthToken(response.data.access_token);
+      setAuthToken(response.data.access_token, response.data.refresh_token);
 
       const userResponse = await authAPI.getCurrentUser();
       setUser(userResponse.data);
@@ -134,6 +137,7 @@ function App() {
   };
 
   const handleLogout = () => {
+    authAPI.logout().catch(() => {});
     setAuthToken(null);
     setIsAuthenticated(false);
     setUser(null);
@@ -238,7 +242,8 @@ function App() {
 
   const handleChangePassword = async (currentPassword, newPassword) => {
     try {
-      await authAPI.changePassword({ current_password: currentPassword, new_password: newPassword });
+      const response = await authAPI.changePassword({ current_password: currentPassword, new_password: newPassword });
+      setAuthToken(getAuthToken(), response.data.refresh_token);
       toast.success('Password changed successfully!');
     } catch (err) {
       const errorMsg = err.response?.data?.detail || 'Failed to change password';
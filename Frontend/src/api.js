@@ -22,21 +22,70 @@ api.interceptors.request.use(
   }
 );
 
+const SESSION_ENDPOINTS = ['/auth/login', '/auth/register', '/auth/refresh', '/auth/logout'];
+
+// Concurrent 401s share one refresh: a refresh token may only be spent once.
+let refreshing = null;
+
+const refreshSession = () => {
+  if (!refreshing) {
+    const refreshToken = localStorage.getItem('refreshToken');
+    refreshing = axios
+      .post(`${API_BASE_URL}/auth/refresh`, { refresh_token: refreshToken })
+      .then((response) => {
+        setAuthToken(response.data.access_token, response.data.refresh_token);
+        return response.data.access_token;
+      })
+      .catch((error) => {
+        setAuthToken(null);
+        throw error;
+      })
+      .finally(() => {
+        refreshing = null;
+      });
+  }
+  return refreshing;
+};
+
+api.interceptors.response.use(
+  (response) => response,
+  async (error) => {
+    const original = error.config;
+    const canRefresh = !original._retried && !SESSION_ENDPOINTS.includes(original.url)
+      && localStorage.getItem('refreshToken');
+    if (error.response?.status !== 401 || !canRefresh) {
+      return Promise.reject(error);
+    }
+    original._retried = true;
+    const token = await refreshSession();
+    original.headers.Authorization = `Bearer ${token}`;
+    return api(original);
+  }
+);
+
 export const authAPI = {
   register: (data) => api.post('/auth/register', data),
   login: (data) => api.post('/auth/login', data),
+  logout: () => api.post('/auth/logout', { refresh_token: localStorage.getItem('refreshToken') }),
   getCurrentUser: () => api.get('/auth/me'),
   updateProfile: (data) => api.put('/auth/profile', data),
   changePassword: (data) => api.put('/auth/password', data),
 };
 
 export const transactionAPI = {
-  getAll: () => api.get('/transactions'),
-  getOne: (id) => api.get(`/transactions/${id}`),
+  getAll: (fields) => api.get('/transactions', { params: { fields } }),
+  getOne: (id, fields) => api.get(`/transactions/${id}`, { params: { fields } }),
   create: (data) => api.post('/transactions', data),
   update: (id, data) => api.put(`/transactions/${id}`, data),
   delete: (id) => api.delete(`/transactions/${id}`),
+  bulkUpdate: (filter, patch) => api.post('/transactions/bulk-update', { filter, $set: patch }),
+  bulkDelete: (filter) => api.post('/transactions/bulk-delete', { filter }),
   getSummary: () => api.get('/summary'),
+  getAnalytics: (months = 12) => api.get('/analytics', { params: { months } }),
+};
+
+export const categoryAPI = {
+  search: (prefix = '', limit = 10) => api.get('/categories', { params: { prefix, limit } }),
 };
 
 export const recurringTransactionAPI = {
@@ -53,13 +102,32 @@ export const goalAPI = {
   create: (data) => api.post('/goals', data),
   update: (id, data) => api.put(`/goals/${id}`, data),
   delete: (id) => api.delete(`/goals/${id}`),
+  contribute: (id, data) => api.post(`/goals/${id}/contributions`, data),
+  getContributions: (id, params) => api.get(`/goals/${id}/contributions`, { params }),
+};
+
+export const budgetAPI = {
+  getAll: () => api.get('/budgets'),
+  create: (data) => api.post('/budgets', data),
+  update: (id, data) => api.put(`/budgets/${id}`, data),
+  delete: (id) => api.delete(`/budgets/${id}`),
+};
+
+export const reportAPI = {
+  create: (data) => api.post('/reports', data),
+  get: (id) => api.get(`/reports/${id}`),
+  download: (id) => api.get(`/reports/${id}/download`, { responseType: 'blob' }),
 };
 
-export const setAuthToken = (token) => {
+export const setAuthToken = (token, refreshToken) => {
   if (token) {
     localStorage.setItem('token', token);
   } else {
     localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
+  }
+  if (refreshToken) {
+    localStorage.setItem('refreshToken', refreshToken);
   }
 };
 
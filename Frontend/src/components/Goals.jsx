@@ -88,16 +88,15 @@ const Goals = ({ currencySymbol = '$' }) => {
     const goal = goals.find(g => g._id === goalId);
     if (!goal) return;
 
-    const newAmount = Math.min(goal.current_amount + amount, goal.target_amount);
-
     try {
-      await goalAPI.update(goalId, { current_amount: newAmount });
-      if (newAmount >= goal.target_amount) {
+      const response = await goalAPI.contribute(goalId, { amount });
+      const updatedGoal = response.data;
+      if (updatedGoal.current_amount >= updatedGoal.target_amount) {
         toast.success('🎉 Goal achieved! Congratulations!');
       } else {
         toast.success(`${currencySymbol}${amount.toFixed(2)} added to ${goal.name}!`);
       }
-      await fetchGoals();
+      setGoals(goals.map(g => (g._id === goalId ? updatedGoal : g)));
       setShowContributeModal(null);
       setContributeAmount('');
     } catch (err) {